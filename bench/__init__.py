@@ -0,0 +1,333 @@
+"""
+Offline benchmarks against the local stand-in API (bench.server).
+
+    python -m bench [-o results.json]
+
+itch reads its API urls from the environment when first imported, so the
+stand-in is started and the environment set before any itch import.
+"""
+import argparse
+import errno
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from server import StandIn
+
+CACHES = ('file', 'sqlite', 'redis', 'memcache')
+
+
+class Skipped(Exception):
+    pass
+
+
+def main():
+    args = __parse_args()
+    server = StandIn(
+        latency=args.latency / 1000.0,
+        followers=args.followers,
+        following=args.following,
+        windows=args.windows,
+        messages=args.messages,
+    ).start()
+    os.environ.update(server.env())
+    tmp = tempfile.mkdtemp(prefix='itch-bench-')
+    os.environ['TWITCH_CACHE_TEMP'] = os.path.join(tmp, 'files')
+    os.environ['TWITCH_CACHE_SQLITE'] = os.path.join(tmp, 'cache.sqlite')
+    os.environ['TWITCH_ARCHIVE_DIR'] = os.path.join(tmp, 'archive')
+
+    try:
+        results = run(args, server, tmp)
+    finally:
+        from itch import TwitchAPI
+        if TwitchAPI.transport:
+            TwitchAPI.transport.close()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print data
+
+
+def run(args, server, tmp):
+    from itch.reports import print_followers, print_following, chatlog
+
+    channel = 'benchchannel'
+    repeat = args.repeat
+    benches = [
+        ('followers', repeat,
+         lambda: print_followers(channel, limit=args.followers)),
+        ('followers_parallel', repeat,
+         lambda: print_followers(channel, limit=args.followers,
+                                 parallel=args.workers)),
+        ('following', repeat, lambda: print_following(channel)),
+        ('chatlog', repeat, lambda: chatlog('v1', workers=args.workers)),
+    ]
+    # the stand-in listens on a new port each time, so cache keys from
+    # earlier invocations never match and the first run is always cold
+    for cache in args.caches:
+        bench = cached(cache, channel, args)
+        benches.append(('cache_%s_cold' % cache, 1, bench))
+        benches.append(('cache_%s_warm' % cache, repeat, bench))
+
+    results = {
+        'config': {
+            'latency_ms': args.latency,
+            'followers': args.followers,
+            'following': args.following,
+            'windows': args.windows,
+            'messages': args.messages,
+            'workers': args.workers,
+            'repeat': args.repeat,
+        },
+        'revision': revision(),
+        'python': '%d.%d.%d' % sys.version_info[:3],
+        'benchmarks': {},
+    }
+    for name, times, func in benches:
+        if args.only and name not in args.only:
+            continue
+        results['benchmarks'][name] = measure(func, server, times)
+    if not args.only or 'plot' in args.only:
+        results['benchmarks']['plot'] = plot(channel, args, tmp)
+    return results
+
+
+def cached(cache, channel, args):
+    """
+    print_followers through a cache adapter; the cold run fills the
+    cache, the warm run after it reads from it. Skipped when the adapter's
+    client is not installed or its server is not running.
+    """
+    from itch import TwitchAPI
+    from itch.reports import print_followers
+
+    def bench():
+        try:
+            print_followers(channel, limit=args.followers, caching=cache)
+        except Exception as e:
+            if unavailable(e):
+                raise Skipped('%s: %s' % (type(e).__name__, e))
+            raise
+        finally:
+            TwitchAPI.set_caching(None)
+    return bench
+
+
+def unavailable(e):
+    """
+    Whether `e` means a cache client is missing or its server refused the
+    connection, rather than a failure of the code being measured.
+    """
+    if isinstance(e, ImportError):
+        return True
+    if isinstance(e, socket.error) and e.errno == errno.ECONNREFUSED:
+        return True
+    try:
+        from redis.exceptions import ConnectionError
+    except ImportError:
+        return False
+    return isinstance(e, ConnectionError)
+
+
+def measure(func, server, repeat):
+    from itch import TwitchAPI
+    from itch.metrics import metrics
+
+    runs = []
+    for i in range(repeat):
+        metrics.reset()
+        served = server.requests
+        TwitchAPI.set_caching(None)
+        try:
+            with quiet() as out:
+                start = time.time()
+                func()
+                elapsed = time.time() - start
+        except Skipped as e:
+            return {'skipped': str(e)}
+        runs.append((elapsed, out.lines, server.requests - served,
+                     metrics.snapshot()))
+
+    runs.sort(key=lambda r: r[0])
+    elapsed, rows, requests, snap = runs[len(runs) // 2]
+    latency = busiest(snap['histograms'].get('api.latency', {}))
+    counters = snap['counters']
+    return {
+        'seconds': round(elapsed, 4),
+        'min_seconds': round(runs[0][0], 4),
+        'rows': rows,
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else 0,
+        'requests': requests,
+        'latency_p50_ms': round(latency.get('p50', 0) * 1000, 2),
+        'latency_p95_ms': round(latency.get('p95', 0) * 1000, 2),
+        'bytes': sum(counters.get('api.bytes', {}).values()),
+        'cache_hits': sum(counters.get('cache.hit', {}).values()),
+        'cache_misses': sum(counters.get('cache.miss', {}).values()),
+    }
+
+
+def busiest(hists):
+    """
+    The busiest endpoint's histogram snapshot.
+    """
+    if not hists:
+        return {}
+    return max(hists.values(), key=lambda h: h['count'])
+
+
+def plot(channel, args, tmp):
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    try:
+        import plot as plotter
+    except ImportError as e:
+        return {'skipped': 'ImportError: %s' % e}
+
+    from itch.reports import print_followers
+    infile = os.path.join(tmp, 'followers.tsv')
+    with open(infile, 'w') as f, redirect(f):
+        print_followers(channel, limit=args.followers)
+
+    outfile = os.path.join(tmp, 'followers.png')
+    argv = sys.argv
+    sys.argv = ['itch-plot', '-s', infile, outfile]
+    try:
+        start = time.time()
+        plotter.main()
+        elapsed = time.time() - start
+    finally:
+        sys.argv = argv
+    return {'seconds': round(elapsed, 4), 'rows': args.followers}
+
+
+class Counted(object):
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, data):
+        self.lines += data.count('\n')
+
+    def flush(self):
+        pass
+
+
+@contextmanager
+def quiet():
+    out = Counted()
+    with redirect(out):
+        yield out
+
+
+@contextmanager
+def redirect(out):
+    stdout = sys.stdout
+    sys.stdout = out
+    try:
+        yield out
+    finally:
+        sys.stdout = stdout
+
+
+def revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def __parse_args():
+    args = argparse.ArgumentParser(
+        description='itch benchmarks against a local stand-in API')
+
+    args.add_argument(
+        '-o', '--output',
+        dest='output',
+        help='write json results to a file instead of stdout',
+    )
+
+    args.add_argument(
+        '-L', '--latency',
+        dest='latency',
+        help='stand-in response latency (ms)',
+        type=float,
+        default=5,
+    )
+
+    args.add_argument(
+        '-f', '--followers',
+        dest='followers',
+        help='followers per channel',
+        type=int,
+        default=2000,
+    )
+
+    args.add_argument(
+        '-F', '--following',
+        dest='following',
+        help='channels followed per user',
+        type=int,
+        default=500,
+    )
+
+    args.add_argument(
+        '--windows',
+        dest='windows',
+        help='rechat windows per video',
+        type=int,
+        default=40,
+    )
+
+    args.add_argument(
+        '--messages',
+        dest='messages',
+        help='messages per rechat window',
+        type=int,
+        default=50,
+    )
+
+    args.add_argument(
+        '-w', '--workers',
+        dest='workers',
+        help='concurrent requests for parallel benchmarks',
+        type=int,
+        default=8,
+    )
+
+    args.add_argument(
+        '-r', '--repeat',
+        dest='repeat',
+        help='runs per benchmark; the median is reported',
+        type=int,
+        default=3,
+    )
+
+    args.add_argument(
+        '-c', '--cache',
+        dest='caches',
+        help='cache adapters to benchmark',
+        action='append',
+        choices=CACHES,
+    )
+
+    args.add_argument(
+        'only',
+        nargs='*',
+        help='benchmarks to run (default: all)',
+    )
+
+    options = args.parse_args(sys.argv[1:])
+    options.caches = options.caches or list(CACHES)
+    return options
@@ -0,0 +1,261 @@
+import gzip
+import json
+import re
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from datetime import datetime, timedelta
+from urlparse import urlsplit, parse_qs
+
+EPOCH = datetime(2012, 1, 1)
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the kraken, rechat and tmi APIs, serving
+    deterministic synthetic data: `followers` follows per channel and
+    `following` per user, `videos` videos per channel, `windows` 30
+    second windows of rechat with `messages` messages each, and
+    `chatters` chatters.
+    Every response waits `latency` seconds first.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0, followers=1000, following=100,
+                 videos=10, windows=20, messages=20, chatters=500,
+                 gzip=True):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.followers = followers
+        self.following = following
+        self.videos = videos
+        self.windows = windows
+        self.messages = messages
+        self.chatters = chatters
+        self.gzip = gzip
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def env(self):
+        """
+        Environment pointing itch at this server; set it before
+        importing itch.
+        """
+        return {
+            'TWITCH_KRAKEN': self.url + '/kraken',
+            'TWITCH_RECHAT': self.url + '/rechat-messages',
+            'TWITCH_TMI': self.url,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # one write per response, sent straight away
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    routes = [
+        (re.compile(r'^/kraken/channels/([^/]+)/follows$'), 'followers'),
+        (re.compile(r'^/kraken/users/([^/]+)/follows/channels$'),
+         'following'),
+        (re.compile(r'^/kraken/channels/([^/]+)/videos$'), 'videos'),
+        (re.compile(r'^/kraken/channels/([^/]+)$'), 'channel'),
+        (re.compile(r'^/kraken/users/([^/]+)$'), 'user'),
+        (re.compile(r'^/kraken/videos/([^/]+)$'), 'video'),
+        (re.compile(r'^/kraken/streams/([^/]+)$'), 'stream'),
+        (re.compile(r'^/group/user/([^/]+)/chatters$'), 'chatters'),
+        (re.compile(r'^/rechat-messages()$'), 'rechat'),
+    ]
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(parts.query).items())
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        for pattern, name in self.routes:
+            mat = pattern.match(parts.path)
+            if mat:
+                body = getattr(self, name)(mat.group(1), query)
+                return self.respond(200, body)
+        self.respond(404, {'error': 'Not Found', 'status': 404})
+
+    def respond(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        accept = self.headers.get('accept-encoding', '')
+        if self.server.gzip and 'gzip' in accept:
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(data)
+            data = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+    def channel(self, name, query=None):
+        return {
+            '_id': _id(name),
+            'name': name,
+            'display_name': name,
+            'followers': self.server.followers,
+            'created_at': _time(_id(name) % 1000),
+            'updated_at': _time(2000),
+        }
+
+    def user(self, name, query=None):
+        return {
+            '_id': _id(name),
+            'name': name,
+            'display_name': name,
+            'type': 'user',
+            'created_at': _time(_id(name) % 1000),
+        }
+
+    def followers(self, name, query):
+        return self.follows(query, self.server.followers, lambda i: {
+            'created_at': _time(1000 + i),
+            'user': self.user('user%07d' % i),
+        })
+
+    def following(self, name, query):
+        return self.follows(query, self.server.following, lambda i: {
+            'created_at': _time(1000 + i),
+            'channel': self.channel('channel%05d' % i),
+        })
+
+    def follows(self, query, total, item):
+        limit = _int(query.get('limit'), 25)
+        offset = _int(query.get('cursor') or query.get('offset'), 0)
+        end = min(total, offset + limit)
+        return {
+            '_total': total,
+            '_cursor': str(end),
+            '_links': {'next': None},
+            'follows': [item(i) for i in xrange(offset, end)],
+        }
+
+    def videos(self, name, query):
+        limit = _int(query.get('limit'), 10)
+        offset = _int(query.get('offset'), 0)
+        end = min(self.server.videos, offset + limit)
+        next_url = None
+        if offset < self.server.videos:
+            next_url = '%s%s?broadcasts=true&limit=%d&offset=%d' % (
+                self.server.url, urlsplit(self.path).path, limit, end)
+        return {
+            '_total': self.server.videos,
+            '_links': {'next': next_url},
+            'videos': [self.video('v%d' % i, channel=name)
+                       for i in xrange(offset, end)],
+        }
+
+    def video(self, vid_id, query=None, channel='channel'):
+        return {
+            '_id': vid_id,
+            'title': 'video %s' % vid_id,
+            'broadcast_type': 'archive',
+            'length': self.server.windows * 30,
+            'recorded_at': _time(3000),
+            'created_at': _time(3000),
+            'channel': {'name': channel, 'display_name': channel},
+        }
+
+    def stream(self, name, query=None):
+        return {'stream': None, '_links': {}}
+
+    def chatters(self, name, query=None):
+        count = self.server.chatters
+        mods = min(10, count)
+        return {
+            'chatter_count': count,
+            'chatters': {
+                'moderators': ['mod%04d' % i for i in xrange(mods)],
+                'staff': [],
+                'admins': [],
+                'global_mods': [],
+                'viewers': ['viewer%06d' % i
+                            for i in xrange(count - mods)],
+            },
+        }
+
+    def rechat(self, unused, query):
+        # windows start at 1000, so the boundary probe at 0 fails
+        first = 1000
+        last = first + (self.server.windows - 1) * 30
+        start = _int(query.get('start'), 0)
+        if not first <= start <= last:
+            return {'errors': [{
+                'status': 400,
+                'detail': '%d is not between %d and %d' % (start, first, last),
+            }]}
+
+        # `messages` per 30 seconds, numbered over the whole video, so
+        # overlapping windows share messages like real rechat
+        rate = self.server.messages
+        total = self.server.windows * rate
+        lo = min(total, -(-(start - first) * rate // 30))
+        hi = min(total, -(-(start - first + 30) * rate // 30))
+        messages = []
+        for seq in xrange(lo, hi):
+            second = first + seq * 30 // rate
+            messages.append({
+                'id': 'm%d' % seq,
+                'type': 'rechat-message',
+                'attributes': {
+                    'from': 'viewer%06d' % (seq % 997),
+                    'message': 'message %d Kappa' % seq,
+                    'timestamp': _timestamp(3000) * 1000 + second * 1000,
+                    'video-offset': second * 1000,
+                    'tags': {'subscriber': seq % 3 == 0},
+                },
+            })
+        return {'data': messages}
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _id(name):
+    return sum(ord(c) * 31 ** i for i, c in enumerate(name)) % 10 ** 8
+
+
+def _time(hours):
+    dt = EPOCH + timedelta(hours=hours)
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _timestamp(hours):
+    return int((EPOCH + timedelta(hours=hours) -
+                datetime(1970, 1, 1)).total_seconds())
@@ -1,29 +1,219 @@
 import hashlib
 import json
 import os
-import zlib
+import re
+import struct
+import time
 import logging
 from itch.log import logger
+from itch.metrics import metrics
+from itch.trace import span
+from codec import by_id, by_name, RawCodec, ZlibCodec
+
+MISS = None
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+class FreshnessPolicy(object):
+    """
+    Per-endpoint cache lifetimes. Rules are (url pattern, ttl, stale) tuples;
+    the first pattern found in the url wins. A ttl of None never expires,
+    and 0 disables caching. Entries older than ttl but within the extra
+    `stale` seconds are served while they are revalidated.
+    """
+
+    default_rules = [
+        (r'tmi\.twitch\.tv/group/user/[^/]+/chatters', 60, 0),
+        (r'/kraken/streams/', 60, 30),
+    ]
+
+    def __init__(self, rules=None, default_ttl=None, default_stale=0):
+        if rules is None:
+            rules = FreshnessPolicy.default_rules
+        if default_ttl is None and os.environ.get('TWITCH_CACHE_TTL'):
+            default_ttl = int(os.environ.get('TWITCH_CACHE_TTL'))
+
+        self.rules = [(re.compile(p), ttl, stale) for p, ttl, stale in rules]
+        self.default = (default_ttl, default_stale)
+
+    def lookup(self, url):
+        for pattern, ttl, stale in self.rules:
+            if pattern.search(url):
+                return ttl, stale
+        return self.default
+
+    def expiry(self, url):
+        ttl, stale = self.lookup(url)
+        if ttl is None:
+            return None
+        return ttl + (stale or 0)
+
+    def state(self, url, stored_at):
+        ttl, stale = self.lookup(url)
+        if ttl is None:
+            return FRESH
+        if stored_at is None:
+            return MISS
+
+        age = time.time() - stored_at
+        if age <= ttl:
+            return FRESH
+        if age <= ttl + (stale or 0):
+            return STALE
+        return MISS
 
 
 class CacheInterface(object):
+    def __init__(self, policy=None, codec=None):
+        self.policy = policy or FreshnessPolicy()
+        self.codec = codec or by_name(os.environ.get('TWITCH_CACHE_CODEC'))
+
+    def set_policy(self, policy):
+        self.policy = policy
+
     def get(self, base_url, query_params=None):
+        return self.lookup(base_url, query_params)[0]
+
+    def lookup(self, base_url, query_params=None):
         key = self.get_key(base_url, query_params)
-        val = self.get_value(key)
-        if val:
-            return Compression.decompress(val)
+        return self.decode(base_url, key, self.read(key))
+
+    def get_many(self, requests):
+        """
+        Look up a batch of (base_url, query_params) requests at once,
+        returning a (value, state) pair for each, in order.
+        """
+        keys = [self.get_key(url, params) for url, params in requests]
+        found = self.read_many(keys)
+        return [
+            self.decode(url, key, found.get(key))
+            for (url, params), key in zip(requests, keys)
+        ]
+
+    def decode(self, base_url, key, val):
+        """
+        (value, state) of a stored value, counting it as a hit, or as a
+        miss when absent or expired.
+        """
+        if not val:
+            metrics.incr('cache.miss', self.name())
+            return None, MISS
+
+        stored_at, codec, data = Envelope.unpack(val)
+        state = self.policy.state(base_url, stored_at)
+        if state is MISS:
+            logger.debug('CacheExpired: ' + key)
+            metrics.incr('cache.expired', self.name())
+            metrics.incr('cache.miss', self.name())
+            return None, MISS
+        metrics.incr('cache.hit', self.name())
+        with span('codec', codec.name):
+            return json.loads(codec.decode(data)), state
+
+    def name(self):
+        return type(self).__name__
+
+    def read(self, key):
+        """
+        get_value, timed in the metrics registry. Hits and misses are
+        counted by decode, once expiry is known.
+        """
+        with metrics.timer('cache.get', self.name()), \
+                span('cache.get', self.name()):
+            return self.get_value(key)
+
+    def read_many(self, keys):
+        with metrics.timer('cache.get_many', self.name()), \
+                span('cache.get', self.name()):
+            return self.get_values(keys)
+
+    def write(self, key, value, ttl=None):
+        with metrics.timer('cache.set', self.name()), \
+                span('cache.set', self.name()):
+            res = self.set_value(key, value, ttl)
+        metrics.incr('cache.write', self.name())
+        metrics.incr('cache.bytes_written', self.name(), len(value))
+        return res
 
     def get_value(self, key):
         raise Exception("Method not implemented")
 
+    def get_values(self, keys):
+        found = {}
+        for key in keys:
+            val = self.get_value(key)
+            if val:
+                found[key] = val
+        return found
+
     def set(self, base_url, query_params=None, value=None):
+        return self.store(base_url, query_params, json.dumps(value),
+                          value=value)
+
+    def set_many(self, responses):
+        """
+        Store a batch of (base_url, query_params, value) responses.
+        """
+        by_ttl = {}
+        for url, params, value in responses:
+            ttl = self.policy.expiry(url)
+            if ttl == 0:
+                continue
+
+            data = Envelope.pack(self.codec.encode(json.dumps(value)),
+                                 self.codec)
+            items = by_ttl.setdefault(ttl, {})
+            items[self.get_key(url, params)] = data
+
+        for ttl, items in by_ttl.items():
+            with metrics.timer('cache.set_many', self.name()), \
+                    span('cache.set', self.name()):
+                self.set_values(items, ttl)
+            metrics.incr('cache.write', self.name(), len(items))
+
+    def store(self, base_url, query_params=None, text=None,
+              wire=None, codec=None, value=None):
+        """
+        Store a response body. `text` is the json text; when the body
+        arrived already encoded (`wire`, e.g. gzip), it is kept as-is.
+        `value` is the decoded body, for in-memory tiers.
+        """
+        ttl = self.policy.expiry(base_url)
+        if ttl == 0:
+            return
+
+        if wire is None or codec is None or codec.id == RawCodec.id:
+            codec = self.codec
+            with span('codec', codec.name):
+                wire = codec.encode(text)
+
         key = self.get_key(base_url, query_params)
-        return self.set_value(key, Compression.compress(value))
+        return self.write(key, Envelope.pack(wire, codec), ttl)
 
-    def set_value(self, key, value):
+    def set_value(self, key, value, ttl=None):
         raise Exception("Method not implemented")
 
-    def get_key(self, base_url, query_params):
+    def set_values(self, items, ttl=None):
+        for key, value in items.items():
+            self.set_value(key, value, ttl)
+
+    def acquire(self, key, ttl):
+        """
+        Take a short-lived lock, shared between processes, while `key` is
+        being fetched. Returns a token, or None when another process holds
+        it. Adapters without shared locks always grant it.
+        """
+        return True
+
+    def release(self, key, token):
+        pass
+
+    def locked(self, key):
+        return False
+
+    @staticmethod
+    def get_key(base_url, query_params):
         query_params = query_params or {}
         query_string = []
         for key in sorted(query_params):
@@ -31,11 +221,27 @@ class CacheInterface(object):
         return hashlib.sha256("%s|%s" % (base_url, query_string)).hexdigest()
 
 
-class Compression(object):
+class Envelope(object):
+    """
+    Stored values are prefixed with a magic marker, the codec id and the
+    time they were stored. Values written by releases before the header
+    are zlib json, with no known age.
+    """
+
+    magic = 'i2'
+    header = struct.Struct('!2sBd')
+
     @staticmethod
-    def compress(data):
-        return zlib.compress(json.dumps(data))
+    def pack(data, codec, stored_at=None):
+        if stored_at is None:
+            stored_at = time.time()
+        return Envelope.header.pack(Envelope.magic, codec.id, stored_at) + data
 
     @staticmethod
-    def decompress(data):
-        return json.loads(zlib.decompress(data))
+    def unpack(value):
+        if value[:2] == Envelope.magic:
+            size = Envelope.header.size
+            magic, codec_id, stored_at = Envelope.header.unpack(value[:size])
+            return stored_at, by_id(codec_id), value[size:]
+
+        return None, by_id(ZlibCodec.id), value
@@ -0,0 +1,138 @@
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+class Codec(object):
+    id = None
+    name = None
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def encode(self, text):
+        raise Exception("Method not implemented")
+
+    def decode(self, data):
+        raise Exception("Method not implemented")
+
+
+class RawCodec(Codec):
+    id = 0
+    name = 'raw'
+
+    def encode(self, text):
+        return text
+
+    def decode(self, data):
+        return data
+
+
+class ZlibCodec(Codec):
+    id = 1
+    name = 'zlib'
+
+    def __init__(self, level=None):
+        self.level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+
+    def encode(self, text):
+        return zlib.compress(text, self.level)
+
+    def decode(self, data):
+        return zlib.decompress(data)
+
+
+class GzipCodec(ZlibCodec):
+    id = 2
+    name = 'gzip'
+    wbits = 16 + zlib.MAX_WBITS
+
+    def encode(self, text):
+        z = zlib.compressobj(self.level, zlib.DEFLATED, GzipCodec.wbits)
+        return z.compress(text) + z.flush()
+
+    def decode(self, data):
+        return zlib.decompress(data, GzipCodec.wbits)
+
+
+class DeflateCodec(ZlibCodec):
+    id = 3
+    name = 'deflate'
+
+    def decode(self, data):
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+class Bz2Codec(Codec):
+    id = 4
+    name = 'bz2'
+
+    def __init__(self, level=None):
+        self.level = 9 if level is None else level
+
+    def encode(self, text):
+        return bz2.compress(text, self.level)
+
+    def decode(self, data):
+        return bz2.decompress(data)
+
+
+class LzmaCodec(Codec):
+    id = 5
+    name = 'lzma'
+
+    def __init__(self, level=None):
+        if not lzma:
+            raise Exception("lzma codec requires the lzma module")
+        self.level = 6 if level is None else level
+
+    def encode(self, text):
+        return lzma.compress(text, preset=self.level)
+
+    def decode(self, data):
+        return lzma.decompress(data)
+
+
+codecs = dict((c.id, c) for c in (
+    RawCodec, ZlibCodec, GzipCodec, DeflateCodec, Bz2Codec, LzmaCodec))
+decoders = {}
+
+
+def by_id(codec_id):
+    if codec_id not in decoders:
+        decoders[codec_id] = codecs[codec_id]()
+    return decoders[codec_id]
+
+
+def by_name(spec):
+    """
+    Build a codec from a 'name' or 'name:level' spec, e.g. 'zlib:9'.
+    """
+    name, _, level = (spec or 'zlib').partition(':')
+    for codec in codecs.values():
+        if codec.name == name.strip().lower():
+            return codec(int(level) if level else None)
+    raise Exception("Unknown cache codec: %s" % spec)
+
+
+def for_encoding(content_encoding):
+    """
+    Codec for an HTTP Content-Encoding, or None if it is not supported.
+    """
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding in ('identity', ''):
+        return by_id(RawCodec.id)
+    if encoding in ('gzip', 'x-gzip'):
+        return by_id(GzipCodec.id)
+    if encoding == 'deflate':
+        return by_id(DeflateCodec.id)
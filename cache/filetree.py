@@ -1,32 +1,133 @@
+import argparse
+import errno
 import os
 import re
+import sys
+import tempfile
 from cache import CacheInterface, logger
 
+# read once: os.umask can only be read by setting it, which races threads
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 
 class FileTreeCache(CacheInterface):
     tmp_dir = os.environ.get("TWITCH_CACHE_TEMP", "/tmp/itch")
+    depth = int(os.environ.get("TWITCH_CACHE_DEPTH", 2))
 
     @staticmethod
-    def get_cache_filename(key):
+    def get_cache_filename(key, depth=None, tmp_dir=None):
+        if depth is None:
+            depth = FileTreeCache.depth
+        shards = [key[i * 2:i * 2 + 2] for i in range(depth)]
         return os.path.join(
-            FileTreeCache.tmp_dir,
+            tmp_dir or FileTreeCache.tmp_dir,
+            *shards + [key]
+        )
+
+    @staticmethod
+    def get_legacy_filename(key, tmp_dir=None):
+        return os.path.join(
+            tmp_dir or FileTreeCache.tmp_dir,
             *re.findall('..', key) + ['v']
         )
 
     def get_value(self, key):
         cache_file = FileTreeCache.get_cache_filename(key)
-        if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                val = f.read()
             logger.debug('CacheHit: ' + key)
-            with open(cache_file, 'r') as f:
-                return f.read()
+            return val
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
         logger.debug('CacheMiss: ' + key)
 
-    def set_value(self, key, value=None):
+    def set_value(self, key, value=None, ttl=None):
         cache_file = FileTreeCache.get_cache_filename(key)
-        cache_dir = os.path.dirname(cache_file)
-        if not os.path.isdir(cache_dir):
+        logger.debug('CacheWrite: ' + key)
+        write_atomic(cache_file, value)
+
+
+def write_atomic(path, value):
+    """
+    Write to a temporary file next to `path`, then rename it into place,
+    so readers never see a partially written file.
+    """
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        try:
             os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
-        with open(cache_file, 'w') as f:
-            logger.debug('CacheWrite: ' + key)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
             f.write(value)
+        # mkstemp creates 0600 files; give them the usual umask mode
+        os.chmod(tmp, 0666 & ~UMASK)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def migrate(src=None, dest=None, depth=None):
+    """
+    Move entries from the original 32-level layout into the sharded one.
+    Returns the number of entries moved.
+    """
+    src = src or FileTreeCache.tmp_dir
+    dest = dest or src
+    moved = 0
+    for root, dirs, files in os.walk(src, topdown=False):
+        if 'v' in files:
+            parts = os.path.relpath(root, src).split(os.sep)
+            key = ''.join(parts)
+            if len(parts) == 32 and re.match('^[0-9a-f]{64}$', key):
+                legacy = os.path.join(root, 'v')
+                target = FileTreeCache.get_cache_filename(key, depth, dest)
+                with open(legacy, 'rb') as f:
+                    write_atomic(target, f.read())
+                os.unlink(legacy)
+                moved += 1
+
+        if root != src:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    return moved
+
+
+def main():
+    args = argparse.ArgumentParser(
+        description='Migrate a FileTreeCache to the sharded layout')
+    args.add_argument(
+        'src',
+        nargs='?',
+        help='legacy cache directory',
+        default=FileTreeCache.tmp_dir,
+    )
+    args.add_argument(
+        'dest',
+        nargs='?',
+        help='new cache directory (default: in place)',
+    )
+    args.add_argument(
+        '--depth',
+        dest='depth',
+        help='shard levels',
+        type=int,
+        default=FileTreeCache.depth,
+    )
+    options = args.parse_args(sys.argv[1:])
+    moved = migrate(options.src, options.dest, options.depth)
+    print 'Migrated %d entries' % moved
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+from cache import CacheInterface, Envelope, MISS, logger, metrics, span
+
+
+class LRUCache(CacheInterface):
+    """
+    Size-bounded in-process tier of decoded responses in front of any
+    other adapter. Writes go through to the backend. Sizes are counted as
+    the length of each response's json text. Returned objects are shared
+    between callers and must not be mutated.
+    """
+
+    def __init__(self, backend, max_bytes=None, policy=None):
+        CacheInterface.__init__(self, policy or backend.policy, backend.codec)
+        self.backend = backend
+        self.max_bytes = int(max_bytes or
+                             os.environ.get('TWITCH_CACHE_LRU_BYTES',
+                                            64 * 1024 * 1024))
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, base_url, query_params=None):
+        key = self.get_key(base_url, query_params)
+        hit = self.recall(base_url, key)
+        if hit:
+            return hit
+        return self.decode(base_url, key, self.backend.read(key))
+
+    def get_many(self, requests):
+        keys = [self.get_key(url, params) for url, params in requests]
+        results = [self.recall(url, key)
+                   for (url, params), key in zip(requests, keys)]
+
+        missing = [key for key, hit in zip(keys, results) if not hit]
+        found = self.backend.read_many(missing) if missing else {}
+        for i, ((url, params), key) in enumerate(zip(requests, keys)):
+            if not results[i]:
+                results[i] = self.decode(url, key, found.get(key))
+        return results
+
+    def recall(self, base_url, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.entries[key] = entry
+
+        if entry:
+            value, stored_at, size = entry
+            state = self.policy.state(base_url, stored_at)
+            if state is not MISS:
+                logger.debug('LRUHit: ' + key)
+                metrics.incr('cache.hit', self.name())
+                return value, state
+            self.forget(key)
+        metrics.incr('cache.miss', self.name())
+
+    def decode(self, base_url, key, val):
+        # counted against the backend the value was read from
+        backend = self.backend.name()
+        if not val:
+            metrics.incr('cache.miss', backend)
+            return None, MISS
+
+        stored_at, codec, data = Envelope.unpack(val)
+        state = self.policy.state(base_url, stored_at)
+        if state is MISS:
+            logger.debug('CacheExpired: ' + key)
+            metrics.incr('cache.expired', backend)
+            metrics.incr('cache.miss', backend)
+            return None, MISS
+        metrics.incr('cache.hit', backend)
+
+        with span('codec', codec.name):
+            text = codec.decode(data)
+            value = json.loads(text)
+        self.remember(key, value, stored_at, len(text))
+        return value, state
+
+    def store(self, base_url, query_params=None, text=None,
+              wire=None, codec=None, value=None):
+        if self.policy.expiry(base_url) == 0:
+            return
+
+        key = self.get_key(base_url, query_params)
+        if value is None:
+            self.forget(key)
+        else:
+            self.remember(key, value, time.time(), len(text))
+        return self.backend.store(base_url, query_params, text,
+                                  wire, codec, value)
+
+    def get_value(self, key):
+        return self.backend.get_value(key)
+
+    def get_values(self, keys):
+        return self.backend.get_values(keys)
+
+    def set_value(self, key, value, ttl=None):
+        self.forget(key)
+        return self.backend.set_value(key, value, ttl)
+
+    def set_values(self, items, ttl=None):
+        for key in items:
+            self.forget(key)
+        return self.backend.set_values(items, ttl)
+
+    def acquire(self, key, ttl):
+        return self.backend.acquire(key, ttl)
+
+    def release(self, key, token):
+        return self.backend.release(key, token)
+
+    def locked(self, key):
+        return self.backend.locked(key)
+
+    def remember(self, key, value, stored_at, size):
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= old[2]
+
+            self.entries[key] = (value, stored_at, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                evicted, entry = self.entries.popitem(last=False)
+                self.size -= entry[2]
+                logger.debug('LRUEvict: ' + evicted)
+
+    def forget(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.size -= entry[2]
@@ -1,7 +1,11 @@
 import os
+import time
 from cache import CacheInterface, logger
 import memcache
 
+# memcached reads expiries longer than 30 days as unix timestamps
+MAX_RELATIVE_TTL = 60 * 60 * 24 * 30
+
 
 class MemcacheCache(CacheInterface):
 
@@ -16,6 +20,27 @@ class MemcacheCache(CacheInterface):
 
         logger.debug('CacheMiss: ' + key)
 
-    def set_value(self, key, value=None):
+    def set_value(self, key, value=None, ttl=None):
         logger.debug('CacheWrite: ' + key)
-        return MemcacheCache.mc.set(key, value)
+        return MemcacheCache.mc.set(key, value, time=_expiry(ttl))
+
+    def get_values(self, keys):
+        keys = list(keys)
+        found = MemcacheCache.mc.get_multi(keys) if keys else {}
+        for key in keys:
+            if found.get(key):
+                logger.debug('CacheHit: ' + key)
+            else:
+                logger.debug('CacheMiss: ' + key)
+        return dict((k, v) for k, v in found.items() if v)
+
+    def set_values(self, items, ttl=None):
+        for key in items:
+            logger.debug('CacheWrite: ' + key)
+        return MemcacheCache.mc.set_multi(items, time=_expiry(ttl))
+
+
+def _expiry(ttl):
+    if ttl and ttl > MAX_RELATIVE_TTL:
+        return int(time.time()) + ttl
+    return ttl or 0
@@ -1,4 +1,5 @@
 import os
+import uuid
 from cache import CacheInterface, logger
 from redis import StrictRedis
 
@@ -12,6 +13,11 @@ class RedisCache(CacheInterface):
         db=os.environ.get('REDIS_DB', 1)
     )
 
+    unlock = red.register_script(
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) end return 0"
+    )
+
     def get_value(self, key):
         val = RedisCache.red.get(key)
         if val:
@@ -20,6 +26,36 @@ class RedisCache(CacheInterface):
 
         logger.debug('CacheMiss: ' + key)
 
-    def set_value(self, key, value=None):
+    def set_value(self, key, value=None, ttl=None):
         logger.debug('CacheWrite: ' + key)
-        return RedisCache.red.set(key, value)
+        return RedisCache.red.set(key, value, ex=ttl)
+
+    def get_values(self, keys):
+        keys = list(keys)
+        found = {}
+        for key, val in zip(keys, RedisCache.red.mget(keys) if keys else []):
+            if val:
+                logger.debug('CacheHit: ' + key)
+                found[key] = val
+            else:
+                logger.debug('CacheMiss: ' + key)
+        return found
+
+    def set_values(self, items, ttl=None):
+        pipe = RedisCache.red.pipeline(transaction=False)
+        for key, value in items.items():
+            logger.debug('CacheWrite: ' + key)
+            pipe.set(key, value, ex=ttl)
+        return pipe.execute()
+
+    def acquire(self, key, ttl):
+        token = uuid.uuid4().hex
+        if RedisCache.red.set('lock:' + key, token, nx=True,
+                              px=int(ttl * 1000)):
+            return token
+
+    def release(self, key, token):
+        RedisCache.unlock(keys=['lock:' + key], args=[token])
+
+    def locked(self, key):
+        return bool(RedisCache.red.exists('lock:' + key))
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+from cache import CacheInterface, logger
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        stored_at REAL NOT NULL,
+        expires_at REAL,
+        accessed_at REAL NOT NULL,
+        size INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)",
+    "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)",
+]
+
+BATCH = 500
+
+
+class SQLiteCache(CacheInterface):
+    """
+    Single-file cache in WAL mode, shared safely by every thread and
+    process on the box. Expired rows are dropped, and the least recently
+    read rows are evicted once the file holds more than `max_bytes`.
+    """
+
+    path = os.environ.get('TWITCH_CACHE_SQLITE', '/tmp/itch.sqlite')
+    max_bytes = int(os.environ.get('TWITCH_CACHE_SQLITE_BYTES', 0))
+    evict_every = 1000
+    touch_after = 60
+
+    def __init__(self, path=None, max_bytes=None, policy=None, codec=None):
+        CacheInterface.__init__(self, policy, codec)
+        self.path = path or SQLiteCache.path
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.writes = 0
+
+        db = self.connection()
+        for statement in SCHEMA:
+            db.execute(statement)
+
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if not db:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.text_factory = str
+            self.local.db = db
+        return db
+
+    def get_value(self, key):
+        return self.get_values([key]).get(key)
+
+    def set_value(self, key, value=None, ttl=None):
+        return self.set_values({key: value}, ttl)
+
+    def get_values(self, keys):
+        db = self.connection()
+        now = time.time()
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), BATCH):
+            chunk = keys[i:i + BATCH]
+            rows = db.execute(
+                'SELECT key, value, expires_at, accessed_at FROM cache '
+                'WHERE key IN (%s)' % ','.join('?' * len(chunk)),
+                chunk
+            )
+            touch = []
+            for key, value, expires_at, accessed_at in rows:
+                if expires_at and expires_at < now:
+                    continue
+                found[key] = str(value)
+                if accessed_at < now - self.touch_after:
+                    touch.append((now, key))
+
+            if touch:
+                db.executemany(
+                    'UPDATE cache SET accessed_at = ? WHERE key = ?', touch)
+
+        for key in keys:
+            logger.debug(('CacheHit: ' if key in found else 'CacheMiss: ') +
+                         key)
+        return found
+
+    def set_values(self, items, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        rows = [
+            (key, sqlite3.Binary(value), now, expires_at, now, len(value))
+            for key, value in items.items()
+        ]
+
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache '
+                '(key, value, stored_at, expires_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+        for row in rows:
+            logger.debug('CacheWrite: ' + row[0])
+
+        self.writes += len(rows)
+        if self.writes >= self.evict_every:
+            self.writes = 0
+            self.evict()
+
+    def evict(self):
+        db = self.connection()
+        now = time.time()
+        expired = db.execute(
+            'DELETE FROM cache WHERE expires_at < ?', (now,)).rowcount
+        evicted = 0
+        if self.max_bytes:
+            total = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+            while total > self.max_bytes:
+                rows = db.execute(
+                    'SELECT key, size FROM cache '
+                    'ORDER BY accessed_at LIMIT ?', (BATCH,)).fetchall()
+                if not rows:
+                    break
+
+                drop = []
+                for key, size in rows:
+                    drop.append((key,))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+                db.executemany('DELETE FROM cache WHERE key = ?', drop)
+                evicted += len(drop)
+
+        logger.debug('CacheEvict: %d expired, %d over quota', expired, evicted)
+        return expired + evicted
@@ -1,12 +1,46 @@
+import os
 import sys
+import json
 import argparse
+from itch import TwitchAPI, MAX_RETRY
+from itch.metrics import metrics, record_span
 from itch.reports import reports
+from itch.schedule import Scheduler
+from itch.trace import Profiler, add_hook
 
 
 def main():
     args = __parse_args()
+    if args.rate:
+        TwitchAPI.set_scheduler(Scheduler(rate=args.rate, retries=MAX_RETRY))
+
+    if args.trace:
+        add_hook(record_span)
+        args.stats = args.stats or not args.stats_json
+
+    profile = args.profile or os.environ.get('TWITCH_PROFILE')
+    profiler = Profiler(profile).start() if profile else None
+
     report = reports.get(args.command)
-    report(**vars(args))
+    try:
+        report(**vars(args))
+    finally:
+        if profiler:
+            profiler.stop()
+        __print_stats(args)
+
+
+def __print_stats(args):
+    if args.stats:
+        for line in metrics.summary():
+            print >> sys.stderr, line
+    if args.stats_json:
+        data = json.dumps(metrics.snapshot(), indent=2, sort_keys=True)
+        if args.stats_json == '-':
+            print >> sys.stderr, data
+        else:
+            with open(args.stats_json, 'w') as f:
+                f.write(data)
 
 
 def __parse_args():
@@ -15,7 +49,7 @@ def __parse_args():
         'command',
         nargs='?',
         help='command',
-        choices=reports.keys(),
+        choices=sorted(reports),
     )
 
     args.add_argument(
@@ -42,7 +76,104 @@ def __parse_args():
         '-c', '--cache',
         dest='caching',
         help='cache type. See README for required env vars',
-        choices=['file', 'redis', 'memcache']
+        choices=['file', 'redis', 'memcache', 'sqlite']
+    )
+
+    args.add_argument(
+        '-m', '--memory-cache',
+        dest='memory_cache',
+        help='in-memory cache size (MB) in front of --cache',
+        type=int
+    )
+
+    args.add_argument(
+        '-f', '--count-following',
+        dest='count_following',
+        action='store_true',
+        help='add each follower\'s following count',
+    )
+
+    args.add_argument(
+        '-w', '--workers',
+        dest='workers',
+        help='number of concurrent requests',
+        type=int
+    )
+
+    args.add_argument(
+        '-u', '--unordered',
+        dest='unordered',
+        action='store_true',
+        help='print rows as they complete, ignoring order',
+    )
+
+    args.add_argument(
+        '-p', '--parallel',
+        dest='parallel',
+        help='fetch follow pages by offset with this many workers',
+        type=int
+    )
+
+    args.add_argument(
+        '-s', '--sync',
+        dest='sync',
+        action='store_true',
+        help='followers: only pull follows made since the last sync',
+    )
+
+    args.add_argument(
+        '-a', '--archive',
+        dest='archive',
+        action='store_true',
+        help='chat reports: download to and read from the local chat archive',
+    )
+
+    args.add_argument(
+        '-i', '--interval',
+        dest='interval',
+        help='chatstats: histogram interval in seconds',
+        type=int
+    )
+
+    args.add_argument(
+        '-e', '--endpoints',
+        dest='endpoints',
+        help='warm: any of profile,followers,following,videos,chat',
+    )
+
+    args.add_argument(
+        '-r', '--rate',
+        dest='rate',
+        help='max requests per second, per host',
+        type=float
+    )
+
+    args.add_argument(
+        '--stats',
+        dest='stats',
+        action='store_true',
+        help='print request and cache metrics to stderr when done',
+    )
+
+    args.add_argument(
+        '--stats-json',
+        dest='stats_json',
+        metavar='FILE',
+        help='write request and cache metrics as json (- for stderr)',
+    )
+
+    args.add_argument(
+        '--trace',
+        dest='trace',
+        action='store_true',
+        help='add time per phase (network, cache, codec, ...) to the stats',
+    )
+
+    args.add_argument(
+        '--profile',
+        dest='profile',
+        metavar='FILE',
+        help='write sampled stacks to FILE, in flame graph format',
     )
 
     options = args.parse_args(sys.argv[1:])
@@ -1,18 +1,27 @@
 import os
 import requests
+import threading
 import time
 from log import logger
+from cache.codec import for_encoding
+from flight import SingleFlight
+from metrics import metrics, endpoint
+from trace import span
+from workers import Workers, chunks
 
 common_headers = {'accept': 'application/vnd.twitchtv.v3+json'}
 client_id = os.environ.get('TWITCH_CLIENT_ID', None)
 if client_id:
     common_headers['Client-Id'] = client_id
 
-KRAKEN = 'https://api.twitch.tv/kraken'
-RECHAT = 'https://rechat.twitch.tv/rechat-messages'
-TMI = 'https://tmi.twitch.tv'
+KRAKEN = os.environ.get('TWITCH_KRAKEN', 'https://api.twitch.tv/kraken')
+RECHAT = os.environ.get('TWITCH_RECHAT',
+                        'https://rechat.twitch.tv/rechat-messages')
+TMI = os.environ.get('TWITCH_TMI', 'https://tmi.twitch.tv')
+RECHAT_WINDOW = 30
 MAX_GET = 100
 MAX_RETRY = 3
+FLIGHT_TIMEOUT = 10
 
 LOOTS = 'https://loots.com/api/v1/'
 LOOTS_MAX_GET = 500
@@ -23,48 +32,206 @@ except:
     pass
 
 
+class Retry(Exception):
+    pass
+
+
 class TwitchAPI(object):
     caching = None
+    transport = None
+    scheduler = None
+    lock = threading.Lock()
+    revalidating = set()
+    flight = SingleFlight()
 
     @staticmethod
     def set_caching(cache_interface):
         TwitchAPI.caching = cache_interface
 
     @staticmethod
-    def get(url, payload=None):
+    def set_transport(transport):
+        TwitchAPI.transport = transport
+
+    @staticmethod
+    def get_transport():
+        if not TwitchAPI.transport:
+            with TwitchAPI.lock:
+                if not TwitchAPI.transport:
+                    from transport import Transport
+                    TwitchAPI.transport = Transport(headers=common_headers)
+        return TwitchAPI.transport
+
+    @staticmethod
+    def set_scheduler(scheduler):
+        TwitchAPI.scheduler = scheduler
+
+    @staticmethod
+    def get_scheduler():
+        if not TwitchAPI.scheduler:
+            with TwitchAPI.lock:
+                if not TwitchAPI.scheduler:
+                    from schedule import Scheduler
+                    TwitchAPI.scheduler = Scheduler(retries=MAX_RETRY)
+        return TwitchAPI.scheduler
+
+    @staticmethod
+    def get(url, payload=None, bypass_cache=False):
+        # cache imports itch.log, so importing it at the top is circular
+        from cache import CacheInterface, STALE
         payload = payload or {}
         logger.debug([url, payload])
-        retries = MAX_RETRY
-        res = None
-        while retries > 0:
+        cache = TwitchAPI.caching
+        if cache and not bypass_cache:
+            res, state = cache.lookup(url, payload)
+            if state == STALE:
+                TwitchAPI.revalidate(url, payload)
+            if res:
+                return res
+
+        key = CacheInterface.get_key(url, payload)
+        return TwitchAPI.flight.do(
+            key, lambda: TwitchAPI.fetch(url, payload, key, bypass_cache))
+
+    @staticmethod
+    def fetch(url, payload, key, bypass_cache=False):
+        cache = TwitchAPI.caching
+        if not cache:
+            return TwitchAPI.request(url, payload)
+
+        token = cache.acquire(key, FLIGHT_TIMEOUT)
+        if not token:
+            res = TwitchAPI.await_peer(url, payload, key, bypass_cache)
+            if res:
+                return res
+
+        try:
+            return TwitchAPI.request(url, payload)
+        finally:
+            if token:
+                cache.release(key, token)
+
+    @staticmethod
+    def await_peer(url, payload, key, bypass_cache=False):
+        """
+        Another process holds the fetch lock for this key;
+        poll the cache for its response until the lock lapses.
+        """
+        from cache import FRESH
+        cache = TwitchAPI.caching
+        deadline = time.time() + FLIGHT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            res, state = cache.lookup(url, payload)
+            if res and (state == FRESH or not bypass_cache):
+                logger.debug('Coalesced: ' + key)
+                return res
+            if not cache.locked(key):
+                return
+
+    @staticmethod
+    def request(url, payload):
+        scheduler = TwitchAPI.get_scheduler()
+        cache = TwitchAPI.caching
+        label = endpoint(url)
+        attempt = 0
+        while True:
+            res = None
+            retry_after = None
+            status_code = None
             try:
-                cache = TwitchAPI.caching
-                if cache:
-                    res = cache.get(url, payload)
-                    if res:
-                        return res
+                scheduler.acquire(url)
+                metrics.incr('api.requests', label)
+                with metrics.timer('api.latency', label), \
+                        span('network', label):
+                    res, wire, encoding = TwitchAPI.get_transport().fetch(
+                        url, params=payload, headers=common_headers)
+                metrics.incr('api.bytes', label, len(wire))
+                if scheduler.retryable(res.status_code):
+                    status_code = res.status_code
+                    retry_after = res.headers.get('retry-after')
+                    raise Retry('HTTP %d' % res.status_code)
 
-                res = requests.get(url, params=payload,
-                                   headers=common_headers, verify=False)
-                j = res.json()
-                if cache:
-                    cache.set(url, payload, j)
+                with span('decode', label):
+                    codec = for_encoding(encoding)
+                    res._content = codec.decode(wire) if codec else wire
+                    j = res.json()
 
                 if "error" in j and j['error']:
                     raise Exception(j.get("error"))
+                if cache:
+                    cache.store(url, payload, res.content,
+                                wire=wire, codec=codec, value=j)
                 return j
-            except ValueError as e:
-                logger.exception(e)
-                if res:
+            except (ValueError, Retry, requests.ConnectionError,
+                    requests.Timeout) as e:
+                logger.warning('%s: %s', url, e)
+                if res is not None and not isinstance(e, Retry):
                     logger.warning(res.text)
-                retries -= 1
-                if retries <= 0:
+                if attempt + 1 >= scheduler.retries:
+                    metrics.incr('api.errors', label)
                     raise
-                time.sleep(0.3)
+                metrics.incr('api.retries', label)
+                time.sleep(scheduler.delay(url, attempt, retry_after,
+                                           status_code))
+                attempt += 1
             except Exception as e:
+                metrics.incr('api.errors', label)
                 logger.exception(e)
                 raise e
 
+    @staticmethod
+    def get_many(requests, workers=None, ordered=True):
+        """
+        Fetch (url, payload) requests, from a list or a stream, checking
+        the cache for MAX_GET of them at a time and fetching the misses
+        concurrently in a single pool. Yields (index, response) pairs.
+        """
+        from cache import STALE
+        cache = TwitchAPI.caching
+
+        def lookups():
+            for batch in chunks(requests, MAX_GET):
+                batch = [(url, payload or {}) for url, payload in batch]
+                cached = [(None, None)] * len(batch)
+                if cache:
+                    cached = cache.get_many(batch)
+                for request, hit in zip(batch, cached):
+                    yield request, hit
+
+        def fetch(task):
+            i, ((url, payload), (res, state)) = task
+            if state == STALE:
+                TwitchAPI.revalidate(url, payload)
+            if res:
+                return i, res
+            return i, TwitchAPI.get(url, payload, bypass_cache=bool(cache))
+
+        return Workers(workers).map(fetch, enumerate(lookups()), ordered)
+
+    @staticmethod
+    def revalidate(url, payload=None):
+        # callers reuse their payload for the next page; keep this one
+        payload = dict(payload or {})
+        key = TwitchAPI.caching.get_key(url, payload)
+        with TwitchAPI.lock:
+            if key in TwitchAPI.revalidating:
+                return
+            TwitchAPI.revalidating.add(key)
+
+        def refresh():
+            try:
+                TwitchAPI.get(url, payload, bypass_cache=True)
+            except Exception as e:
+                logger.warning('Revalidation failed: %s %s', url, e)
+            finally:
+                with TwitchAPI.lock:
+                    TwitchAPI.revalidating.discard(key)
+
+        t = threading.Thread(target=refresh)
+        t.daemon = True
+        t.start()
+
 
 def tab_print(*args):
-    print "\t".join(map(unicode, args))
+    with span('output'):
+        print "\t".join(map(unicode, args))
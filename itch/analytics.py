@@ -0,0 +1,147 @@
+import re
+import struct
+from hashlib import md5
+from math import log
+
+WORDS = re.compile(r'\w{2,}', re.UNICODE)
+
+
+class SpaceSaving(object):
+    """
+    Approximate top-k counter in fixed memory, after Space-Saving: once
+    more than twice `capacity` keys are tracked, only the `capacity`
+    largest are kept, and keys seen afterwards start from the largest
+    count dropped, which is also their error bound.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+            return
+
+        counts[key] = self.floor + count
+        self.errors[key] = self.floor
+        if len(counts) > 2 * self.capacity:
+            self.prune()
+
+    def prune(self):
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)
+        for key in keys[self.capacity:]:
+            self.floor = max(self.floor, self.counts.pop(key))
+            del self.errors[key]
+
+    def top(self, n=10):
+        """
+        [(key, count, error)], highest count first.
+        """
+        keys = sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+        return [(k, self.counts[k], self.errors[k]) for k in keys]
+
+
+class HyperLogLog(object):
+    """
+    Distinct count estimate in 2 ** `precision` bytes, within about
+    1.04 / sqrt(2 ** precision) (1.6% at the default precision).
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        h = struct.unpack('<Q', md5(value).digest()[:8])[0]
+        register = h & (self.size - 1)
+        rest = h >> self.precision
+        rank = 1
+        while not rest & 1 and rank <= 64 - self.precision:
+            rest >>= 1
+            rank += 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * m and zeros:
+            return int(round(m * log(float(m) / zeros)))
+        return int(round(estimate))
+
+
+class Interval(object):
+    __slots__ = ('start', 'messages', 'subscribers', 'chatters')
+
+    def __init__(self, start):
+        self.start = start
+        self.messages = 0
+        self.subscribers = 0
+        self.chatters = set()
+
+
+class ChatStats(object):
+    """
+    Single pass over chat messages in time order. `feed` yields an
+    Interval for every `interval` seconds as it closes, empty ones
+    included, while totals, distinct chatters and the top emitters and
+    keywords accumulate in bounded memory. Messages without a timestamp
+    count towards the interval of the message before them.
+    """
+
+    def __init__(self, interval=60, capacity=1000):
+        self.interval = interval
+        self.messages = 0
+        self.subscribers = 0
+        self.chatters = HyperLogLog()
+        self.emitters = SpaceSaving(capacity)
+        self.keywords = SpaceSaving(capacity)
+
+    def feed(self, messages):
+        current = None
+        for m in messages:
+            name = m['from']
+            if m.timestamp:
+                ts = m.timestamp // 1000
+                start = ts - ts % self.interval
+                if current is None:
+                    current = Interval(start)
+                while start > current.start:
+                    yield current
+                    current = Interval(current.start + self.interval)
+            elif current is None:
+                # no time yet to place it at; count it in the totals only
+                self.add(name, m.message, m.subscriber)
+                continue
+
+            current.messages += 1
+            current.chatters.add(name)
+            if m.subscriber:
+                current.subscribers += 1
+            self.add(name, m.message, m.subscriber)
+
+        if current is not None:
+            yield current
+
+    def add(self, name, message, subscriber=False):
+        self.messages += 1
+        if subscriber:
+            self.subscribers += 1
+        self.chatters.add(name)
+        self.emitters.add(name)
+        for word in WORDS.findall((message or u'').lower()):
+            self.keywords.add(word)
+
+    def subscriber_share(self):
+        if not self.messages:
+            return 0.0
+        return float(self.subscribers) / self.messages
@@ -0,0 +1,149 @@
+import json
+import os
+import zlib
+from bisect import bisect_right
+from cache.filetree import write_atomic
+from models import ChatMessage, CompactChatMessage, model_for
+from models import rechat_window, replay_messages
+
+
+class ChatArchive(object):
+    """
+    Rechat messages of one video, stored locally as append-only zlib
+    chunks (one per window) in `<video>.chunks`, with `<video>.idx` lines
+    of rechat `offset, position, length` to seek by. A download
+    resumes after the last window in the index.
+    """
+    path = os.environ.get('TWITCH_ARCHIVE_DIR', '/tmp/itch-archive')
+
+    def __init__(self, video_id, path=None):
+        self.video_id = str(video_id)
+        self.path = path or ChatArchive.path
+        self._index = None
+        self._index_size = 0
+
+    def filename(self, ext):
+        return os.path.join(self.path, '%s.%s' % (self.video_id, ext))
+
+    def meta(self):
+        try:
+            with open(self.filename('json'), 'r') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+
+    def index(self):
+        if self._index is None:
+            self._index, self._index_size = self.load_index()
+        return self._index
+
+    def load_index(self):
+        """
+        (entries, bytes) of the index, up to the first entry that is torn
+        or points past the end of the chunks file.
+        """
+        try:
+            size = os.path.getsize(self.filename('chunks'))
+            with open(self.filename('idx'), 'r') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return [], 0
+
+        index, read = [], 0
+        for line in lines:
+            try:
+                offset, pos, length = map(int, line.split())
+            except ValueError:
+                break
+            if not line.endswith('\n') or pos + length > size:
+                break
+            index.append((offset, pos, length))
+            read += len(line)
+        return index, read
+
+    def complete(self):
+        meta, index = self.meta(), self.index()
+        if not meta or not index:
+            return False
+        return index[-1][0] + meta['window'] > meta['end']
+
+    def download(self, video, window=None, workers=None):
+        """
+        Fetch the windows not archived yet; returns the number fetched.
+        """
+        if self.complete():
+            return 0
+
+        meta = self.meta()
+        if not meta:
+            window = rechat_window(window)
+            start, end = video._replay_boundaries()
+            meta = {'start': start, 'end': end, 'window': window}
+            write_atomic(self.filename('json'), json.dumps(meta))
+
+        index = self.index()
+        start = meta['start']
+        if index:
+            start = index[-1][0] + meta['window']
+        if start > meta['end']:
+            return 0
+
+        windows = video._replay_windows(start, meta['end'],
+                                        meta['window'], workers)
+        return self.append(windows)
+
+    def append(self, windows):
+        index = self.index()
+        end = index[-1][1] + index[-1][2] if index else 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        count = 0
+        with open(self.filename('chunks'), 'ab') as chunks, \
+                open(self.filename('idx'), 'ab') as idx:
+            # drop whatever an interrupted run wrote past the last entry
+            chunks.truncate(end)
+            idx.truncate(self._index_size)
+            for offset, messages in windows:
+                data = zlib.compress(json.dumps(messages))
+                chunks.write(data)
+                chunks.flush()
+                idx.write('%d %d %d\n' % (offset, end, len(data)))
+                idx.flush()
+                index.append((offset, end, len(data)))
+                end += len(data)
+                self._index_size = idx.tell()
+                count += 1
+        return count
+
+    def windows(self, start=None, end=None):
+        """
+        Yield archived (offset, messages) windows overlapping the range of
+        seconds into the video, reading only the chunks in it. The index
+        keeps rechat's own offsets, which start at the boundary found by
+        the download (a unix timestamp for real videos).
+        """
+        index = self.index()
+        if not index:
+            return
+
+        base = self.meta().get('start', 0)
+        first = 0
+        if start is not None:
+            offsets = [offset for offset, pos, length in index]
+            first = max(0, bisect_right(offsets, base + start) - 1)
+
+        with open(self.filename('chunks'), 'rb') as f:
+            f.seek(index[first][1])
+            for offset, pos, length in index[first:]:
+                if end is not None and offset > base + end:
+                    break
+                yield (offset - base,
+                       json.loads(zlib.decompress(f.read(length))))
+
+    def messages(self, start=None, end=None, compact=False):
+        model = model_for(ChatMessage, CompactChatMessage, compact)
+        windows = self.windows(start, end)
+        for message in replay_messages(windows, self.meta().get('window')):
+            yield model(message)
@@ -0,0 +1,45 @@
+import sys
+import threading
+
+
+class Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Deduplicates concurrent calls: the first caller for a key runs the
+    function, and callers arriving while it is in flight wait for and
+    share its result (or exception).
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            call.done.wait()
+            if call.exc_info:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
@@ -0,0 +1,149 @@
+import json
+import os
+from base64 import b64decode, b64encode
+from array import array
+from itertools import combinations
+from cache.filetree import write_atomic
+from times import to_timestamp
+
+
+class FollowGraph(object):
+    """
+    Local store of who follows which channel, for overlap queries that
+    never touch the API. User names are interned to integer ids, and each
+    channel keeps a sorted array of follower ids with a parallel array of
+    follow timestamps. Saved as json, with the arrays as base64 bytes.
+    """
+    path = os.environ.get('TWITCH_GRAPH', '/tmp/itch-graph.db')
+
+    def __init__(self, path=None):
+        self.path = path or FollowGraph.path
+        self.names = []
+        self.ids = {}
+        self.channels = {}
+        self.pending = {}
+        self.replaced = set()
+
+    @staticmethod
+    def load(path=None):
+        graph = FollowGraph(path)
+        if os.path.isfile(graph.path):
+            with open(graph.path, 'rb') as f:
+                state = json.load(f)
+            graph.names = state['names']
+            graph.ids = dict((n, i) for i, n in enumerate(graph.names))
+            for channel, (ids, ts) in state['channels'].iteritems():
+                graph.channels[channel] = (_array(ids), _array(ts))
+        return graph
+
+    def save(self):
+        self.compact()
+        state = {
+            'names': self.names,
+            'channels': dict(
+                (channel, (_bytes(ids), _bytes(ts)))
+                for channel, (ids, ts) in self.channels.iteritems()
+            ),
+        }
+        write_atomic(self.path, json.dumps(state))
+
+    def intern(self, name):
+        uid = self.ids.get(name)
+        if uid is None:
+            uid = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return uid
+
+    def add(self, channel, user, followed):
+        edges = self.pending.setdefault(channel.lower(), {})
+        edges[self.intern(user.lower())] = to_timestamp(followed)
+
+    def add_followers(self, channel, follows, replace=False):
+        """
+        Feed from list_followers; rows from `fields=('user.name',
+        'created_at')` projections are the cheapest. With `replace` the
+        follows are the channel's full list, and earlier followers not in
+        it are dropped.
+        """
+        if replace:
+            self.replaced.add(channel.lower())
+            self.pending[channel.lower()] = {}
+        for f in follows:
+            name = getattr(f, 'user_name', None) or f.user.name
+            self.add(channel, name, f.created_at)
+
+    def add_following(self, user, follows):
+        for f in follows:
+            name = getattr(f, 'channel_name', None) or f.channel.name
+            self.add(name, user, f.created_at)
+
+    def compact(self):
+        for channel, edges in self.pending.iteritems():
+            ids, ts = self.channels.get(channel, (array('l'), array('l')))
+            if channel in self.replaced:
+                ids, ts = [], []
+            merged = dict(zip(ids, ts))
+            merged.update(edges)
+            order = sorted(merged)
+            self.channels[channel] = (
+                array('l', order),
+                array('l', [merged[uid] for uid in order]),
+            )
+        self.pending = {}
+        self.replaced = set()
+
+    def followers(self, channel):
+        self.compact()
+        return self.channels.get(channel.lower(), (array('l'), None))[0]
+
+    def overlap(self, channels):
+        sets = sorted((self.followers(c) for c in channels), key=len)
+        if not sets:
+            return set()
+        common = set(sets[0])
+        for ids in sets[1:]:
+            common.intersection_update(ids)
+        return common
+
+    def union(self, channels):
+        found = set()
+        for channel in channels:
+            found.update(self.followers(channel))
+        return found
+
+    def pairs(self, channels):
+        """
+        (a, b, shared followers, jaccard index) for every pair of channels.
+        """
+        sets = dict((c, set(self.followers(c))) for c in channels)
+        for a, b in combinations(channels, 2):
+            shared = len(sets[a] & sets[b])
+            total = len(sets[a]) + len(sets[b]) - shared
+            yield a, b, shared, float(shared) / total if total else 0.0
+
+    def followed_before(self, first, then):
+        """
+        Users following both channels who followed `first` before `then`,
+        as (name, first timestamp, then timestamp).
+        """
+        self.compact()
+        ids, ts = self.channels.get(first.lower(), ([], []))
+        followed = dict(zip(ids, ts))
+        ids, ts = self.channels.get(then.lower(), ([], []))
+        for uid, then_ts in zip(ids, ts):
+            first_ts = followed.get(uid)
+            if first_ts is not None and first_ts < then_ts:
+                yield self.names[uid], first_ts, then_ts
+
+    def name(self, uid):
+        return self.names[uid]
+
+
+def _array(data):
+    values = array('l')
+    values.fromstring(b64decode(data))
+    return values
+
+
+def _bytes(values):
+    return b64encode(values.tostring())
@@ -0,0 +1,149 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urlparse import urlsplit
+
+# latency bucket upper bounds, in seconds
+BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+          0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# path segments followed by an id or a name
+COLLECTIONS = ('channels', 'users', 'videos', 'streams', 'user',
+               'rechat-message')
+
+
+class Histogram(object):
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th quantile.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(
+                (str(b), n) for b, n in
+                zip(self.bounds + ('inf',), self.buckets) if n
+            ),
+        }
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of labelled counters and latency histograms,
+    e.g. incr('api.requests', endpoint) or observe('cache.get', adapter).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def incr(self, name, label=None, value=1):
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[label] = counter.get(label, 0) + value
+
+    def observe(self, name, label, seconds):
+        with self.lock:
+            hists = self.histograms.setdefault(name, {})
+            if label not in hists:
+                hists[label] = Histogram()
+            hists[label].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, label=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, label, time.time() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(
+                    (name, dict(counter))
+                    for name, counter in self.counters.iteritems()
+                ),
+                'histograms': dict(
+                    (name, dict((label, h.snapshot())
+                                for label, h in hists.iteritems()))
+                    for name, hists in self.histograms.iteritems()
+                ),
+            }
+
+    def summary(self):
+        """
+        Tab-separated lines: `name, label, value` for counters, and
+        `name, label, count, mean, p50, p95, max` (ms) for histograms.
+        """
+        snap = self.snapshot()
+        lines = []
+        for name in sorted(snap['counters']):
+            counter = snap['counters'][name]
+            for label in sorted(counter):
+                lines.append([name, label or '-', counter[label]])
+        for name in sorted(snap['histograms']):
+            hists = snap['histograms'][name]
+            for label in sorted(hists):
+                h = hists[label]
+                lines.append([name, label or '-', h['count']] + [
+                    '%.1f' % (h[k] * 1000)
+                    for k in ('mean', 'p50', 'p95', 'max')
+                ])
+        return ["\t".join(map(unicode, line)) for line in lines]
+
+
+def endpoint(url):
+    """
+    Metric label for a url: host and path, with ids and names replaced
+    by `*`, e.g. api.twitch.tv/kraken/channels/*/follows.
+    """
+    parts = urlsplit(url)
+    segments = [s for s in parts.path.split('/') if s]
+    for i in range(1, len(segments)):
+        if segments[i - 1] in COLLECTIONS:
+            segments[i] = '*'
+    return '/'.join([parts.netloc] + segments)
+
+
+metrics = Metrics()
+
+
+def record_span(phase, label, seconds):
+    """
+    Trace hook (itch.trace.add_hook) adding span timings to the registry.
+    """
+    metrics.observe('span.' + phase, label, seconds)
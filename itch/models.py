@@ -1,20 +1,27 @@
 import json
+import math
+from collections import deque, namedtuple
 from itch import TwitchAPI as API
 from itch import KRAKEN, RECHAT, TMI, MAX_GET, LOOTS, LOOTS_MAX_GET
+from itch import RECHAT_WINDOW
 from times import to_datetime
 from log import logger
+from trace import hooks, span
+from workers import chunks, read_ahead
 import re
 
 
-class BaseModel(object):
-    def __init__(self, **kwargs):
-        for k, v in kwargs.iteritems():
-            k = k.lstrip('_').replace('-', '_')
-            self.__dict__.update({k: self.typeForKey(k, v)})
+class Model(object):
+    """
+    Field conversions shared by the hydrated models and the compact ones.
+    Has no instance state of its own, so compact subclasses stay slotted.
+    """
+    __slots__ = ()
 
     def typeForKey(self, key, val):
         if key == 'links':
-            val['own_url'] = val.pop("self")
+            val = dict(val)
+            val['own_url'] = val.pop("self", None)
             return Links(**val)
 
         if key in ('created_at', 'updated_at', 'recorded_at'):
@@ -22,6 +29,20 @@ class BaseModel(object):
 
         return val
 
+
+class BaseModel(Model):
+    def __init__(self, **kwargs):
+        if hooks:
+            with span('model', type(self).__name__):
+                self.hydrate(kwargs)
+        else:
+            self.hydrate(kwargs)
+
+    def hydrate(self, kwargs):
+        for k, v in kwargs.iteritems():
+            k = k.lstrip('_').replace('-', '_')
+            self.__dict__.update({k: self.typeForKey(k, v)})
+
     def __repr__(self):
         return json.dumps(
             self,
@@ -34,19 +55,109 @@ class BaseModel(object):
         return self.__dict__.get(item)
 
 
+class CompactModel(Model):
+    """
+    Wraps the response dict itself, without copying it, and converts a
+    field each time it is read; keys are matched with or without their
+    leading underscore, and with dashes for underscores. Instances hold
+    only that reference.
+    """
+    __slots__ = ('_raw',)
+
+    def __init__(self, raw=None, **kwargs):
+        self._raw = kwargs if raw is None else raw
+
+    def field(self, key):
+        raw = self._raw
+        if key in raw:
+            val = raw[key]
+        elif '_' + key in raw:
+            val = raw['_' + key]
+        else:
+            val = raw[key.replace('_', '-')]
+        return self.typeForKey(key, val)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return self.field(name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, item):
+        try:
+            return self.field(item)
+        except KeyError:
+            return None
+
+    def __repr__(self):
+        return json.dumps(self._raw, sort_keys=True, indent=4)
+
+
+class Projection(object):
+    """
+    Builds lightweight named tuples holding only the requested fields,
+    in place of a fully hydrated model. Fields are dotted paths into the
+    response, such as 'user.name'; dates are converted, nothing else is.
+    """
+    date_keys = ('created_at', 'updated_at', 'recorded_at')
+
+    def __init__(self, fields):
+        if isinstance(fields, basestring):
+            fields = fields.split(',')
+        self.fields = [f.strip() for f in fields]
+        self.paths = [f.split('.') for f in self.fields]
+        self.row = namedtuple(
+            'Row', [f.replace('.', '_') for f in self.fields], rename=True)
+
+    def __call__(self, raw):
+        return self.row(*[self.extract(raw, path) for path in self.paths])
+
+    def extract(self, raw, path):
+        val = raw
+        for key in path:
+            if not isinstance(val, dict):
+                return None
+            val = val[key] if key in val else val.get('_' + key)
+
+        if val and path[-1] in Projection.date_keys:
+            return to_datetime(val)
+        return val
+
+
+def model_for(model, compact_model=None, compact=False, fields=None):
+    """
+    Callable building a row from a response dict: a projection, the
+    compact model (which keeps the dict), or the hydrated model.
+    """
+    if fields:
+        return Projection(fields)
+    if compact and compact_model:
+        return compact_model
+    return lambda raw: model(**raw)
+
+
 class Links(BaseModel):
     pass
 
 
-class Entity(BaseModel):
-    def list_followers(self, direction=None, limit=None):
+class Entity(Model):
+    __slots__ = ()
+
+    def list_followers(self, direction=None, limit=None, compact=False,
+                       fields=None, parallel=None):
         direction = direction or 'ASC'
         req_limit = min(limit, MAX_GET)
+        if parallel:
+            req_limit = min(limit or MAX_GET, MAX_GET)
         url = '{}/channels/{}/follows?direction={}&limit={}'
         url = url.format(KRAKEN, self.name, direction, req_limit)
+        model = model_for(Follow, CompactFollow, compact, fields)
         sent = 0
-        for f in Entity.get_follows(url):
-            yield Follow(**f)
+        for f in Entity.get_follows(url, parallel=parallel,
+                                    page_size=req_limit, limit=limit):
+            yield model(f)
             sent += 1
             if limit and sent >= limit:
                 return
@@ -56,22 +167,38 @@ class Entity(BaseModel):
             return f.total
         return 0
 
-    def list_following(self, direction=None, limit=None):
-        direction = direction or 'ASC'
+    @staticmethod
+    def count_following_many(entities, workers=None, ordered=True):
+        requests = ((e._following_url('ASC', 1), None) for e in entities)
+        for i, res in API.get_many(requests, workers, ordered):
+            if res.get("follows"):
+                yield i, res.get("_total")
+            else:
+                yield i, 0
+
+    def list_following(self, direction=None, limit=None, compact=False,
+                       fields=None, parallel=None):
         req_limit = min(limit, MAX_GET)
-        url = '{}/users/{}/follows/channels?direction={}&limit={}'
-        url = url.format(KRAKEN, self.name, direction, req_limit)
+        if parallel:
+            req_limit = min(limit or MAX_GET, MAX_GET)
+        url = self._following_url(direction, req_limit)
+        model = model_for(Follow, CompactFollow, compact, fields)
         sent = 0
-        for f in Entity.get_follows(url):
-            yield Follow(**f)
+        for f in Entity.get_follows(url, parallel=parallel,
+                                    page_size=req_limit, limit=limit):
+            yield model(f)
             sent += 1
             if limit and sent >= limit:
                 return
 
-    def live_stream(self):
+    def _following_url(self, direction=None, limit=None):
+        url = '{}/users/{}/follows/channels?direction={}&limit={}'
+        return url.format(KRAKEN, self.name, direction or 'ASC', limit)
+
+    def live_stream(self, bypass_cache=False):
         url = "{}/streams/{}"
         url = url.format(KRAKEN, self.name)
-        res = API.get(url)
+        res = API.get(url, bypass_cache=bypass_cache)
         stream = res.get("stream", None)
         if stream:
             return Stream(
@@ -79,31 +206,42 @@ class Entity(BaseModel):
                 **stream
             )
 
-    def past_streams(self, cap=None):
+    def past_streams(self, cap=None, fields=None, parallel=None):
         url = "{}/channels/{}/videos"
         url = url.format(KRAKEN, self.name)
+        model = model_for(Video, fields=fields)
         params = {
             "broadcasts": "true",
         }
 
-        read_count = 1
+        if parallel:
+            params["limit"] = MAX_GET
+            pages = Entity.offset_pages(url, params, MAX_GET, parallel, cap)
+        else:
+            pages = Entity.video_pages(url, params, cap)
+
         vods_read = 0
+        for video, res in dedup(read_ahead(pages), 'videos', _item_id):
+            yield model(dict(video, total=res.get("_total")))
+
+            vods_read += 1
+            if cap and vods_read >= cap:
+                return
+
+    @staticmethod
+    def video_pages(url, params=None, limit=None):
+        read_count = 1
+        total = 0
         while read_count:
             if not url:
                 return
 
             res = API.get(url, params)
-            videos = res.get("videos", [])
-            read_count = len(videos)
-            for video in videos:
-                yield Video(
-                    total=res.get("_total"),
-                    **video
-                )
-
-                vods_read += 1
-                if cap and vods_read >= cap:
-                    return
+            yield res
+            read_count = len(res.get("videos", []))
+            total += read_count
+            if limit and total >= limit:
+                return
             url = res.get("_links").get("next", None)
 
     def loots_streams(self, limit=None, direction=None):
@@ -128,37 +266,77 @@ class Entity(BaseModel):
             yield LootsStream(**stream)
 
     @staticmethod
-    def get_follows(url, cursor=None):
+    def get_follows(url, cursor=None, depth=None,
+                    parallel=None, page_size=None, limit=None):
+        if parallel:
+            pages = Entity.offset_pages(url, None, page_size or MAX_GET,
+                                        parallel, limit)
+        else:
+            pages = Entity.follow_pages(url, cursor, limit)
+
+        for follow, res in dedup(read_ahead(pages, depth), 'follows',
+                                 follow_id):
+            yield dict(follow, total=res.get('_total'))
+
+    @staticmethod
+    def offset_pages(url, params, page_size, workers=None, limit=None):
+        """
+        Read `_total` from the first page, then fetch the remaining
+        offsets concurrently, yielding pages in order.
+        """
+        if workers is True:
+            workers = None
+        params = dict(params or {})
+        res = API.get(url, dict(params, offset=0))
+        yield res
+
+        total = res.get("_total") or 0
+        if limit:
+            total = min(total, limit)
+        offsets = xrange(page_size, total, page_size)
+        for batch in chunks(offsets, MAX_GET):
+            requests = [(url, dict(params, offset=o)) for o in batch]
+            for i, res in API.get_many(requests, workers):
+                yield res
+
+    @staticmethod
+    def follow_pages(url, cursor=None, limit=None):
+        """
+        Follow pages by cursor, stopping once `limit` follows have been
+        read, so read-ahead does not fetch pages nobody will consume.
+        """
         payload = {}
         read_count = 1
+        total = 0
         while read_count:
             if cursor:
                 payload["cursor"] = cursor
 
             res = API.get(url, payload)
-            if res:
-                follows = res.get("follows", [])
-                read_count = len(follows)
-                for follow in follows:
-                    follow['total'] = res.get('_total')
-                    yield follow
-
-                if read_count:
-                    cursor = res.get("_cursor")
-                    if not cursor:
-                        url = res.get("_links").get("next")
-
-    def get_chatters(self):
+            if not res:
+                return
+
+            yield res
+            read_count = len(res.get("follows", []))
+            total += read_count
+            if limit and total >= limit:
+                return
+            if read_count:
+                cursor = res.get("_cursor")
+                if not cursor:
+                    url = res.get("_links").get("next")
+
+    def get_chatters(self, bypass_cache=False):
         url = "{}/group/user/{}/chatters"
         url = url.format(TMI, self.name)
-        res = API.get(url)
+        res = API.get(url, bypass_cache=bypass_cache)
         return Chatters(
             count=res.get("chatter_count"),
             **res.get("chatters")
         )
 
 
-class Channel(Entity):
+class Channel(BaseModel, Entity):
     @staticmethod
     def get(name):
         url = '{}/channels/{}'
@@ -169,7 +347,7 @@ class Channel(Entity):
         return User.get(self.name)
 
 
-class User(Entity):
+class User(BaseModel, Entity):
     @staticmethod
     def get(name):
         url = '{}/users/{}'
@@ -187,7 +365,7 @@ class Follow(BaseModel):
     }
 
     def typeForKey(self, key, val):
-        type_class = Follow.type_classes.get(key, None)
+        type_class = self.type_classes.get(key, None)
         if type_class:
             return type_class(**val)
         return BaseModel.typeForKey(self, key, val)
@@ -219,10 +397,11 @@ class Video(BaseModel):
 
         return BaseModel.typeForKey(self, key, val)
 
-    def chat_replay(self):
+    def chat_replay(self, window=None, workers=None, compact=False):
+        model = model_for(ChatMessage, CompactChatMessage, compact)
         start, end = self._replay_boundaries()
-        for message in self._replay_chat(start, end):
-            yield ChatMessage(**message)
+        for message in self._replay_chat(start, end, window, workers):
+            yield model(message)
 
     def _replay_boundaries(self):
         payload = {
@@ -243,32 +422,100 @@ class Video(BaseModel):
             logger.exception(e)
             raise
 
-    def _replay_chat(self, start, end):
-        caches = [set(), set()]
-        cache_index = 0
-        while start <= end:
-            prev_cache = caches[cache_index]
-            cache_index = (cache_index + 1) % 2
-            cache = caches[cache_index] = set()
-
-            payload = {
-                "video_id": self.id,
-                "start": start,
-            }
-
-            res = API.get(RECHAT, payload)
-            if "errors" in res:
-                return
+    def _replay_chat(self, start, end, window=None, workers=None):
+        windows = self._replay_windows(start, end, window, workers)
+        return replay_messages(windows, window)
+
+    def _replay_windows(self, start, end, window=None, workers=None):
+        pages = self._replay_pages(start, end, window, workers)
+        for page in read_ahead(pages):
+            for offset, messages in page:
+                yield offset, messages
+
+    def _replay_pages(self, start, end, window=None, workers=None):
+        window = rechat_window(window)
+
+        offsets = range(start, end + 1, window)
+        if offsets and offsets[-1] != end:
+            # the last window's chat, when `window` does not divide it
+            offsets.append(end)
+        for batch in chunks(offsets, MAX_GET):
+            requests = [
+                (RECHAT, {"video_id": self.id, "start": offset})
+                for offset in batch
+            ]
+            page = []
+            for i, res in API.get_many(requests, workers):
+                if "errors" in res:
+                    yield page
+                    return
 
-            for message in res.get("data"):
-                mid = message.get("id")
-                if mid in prev_cache:
+                messages = res.get("data") or []
+                page.append((batch[i], sorted(messages, key=_message_time)))
+            yield page
+
+
+def dedup(pages, key, item_id):
+    """
+    Yield (item, page) from each page's `key` list, skipping items
+    repeated from the previous page when listings shift between fetches.
+    """
+    seen = set()
+    for res in pages:
+        ids = set()
+        for item in res.get(key) or []:
+            iid = item_id(item)
+            if iid is not None:
+                if iid in seen:
                     continue
-
-                cache.add(mid)
+                ids.add(iid)
+            yield item, res
+        seen = ids
+
+
+def _item_id(item):
+    return item.get("_id")
+
+
+def follow_id(follow):
+    other = follow.get("user") or follow.get("channel") or {}
+    return other.get("_id")
+
+
+def rechat_window(window=None):
+    """
+    Validated window size: each request returns RECHAT_WINDOW seconds of
+    chat, so longer steps would skip chat.
+    """
+    window = window or RECHAT_WINDOW
+    if not 0 < window <= RECHAT_WINDOW:
+        raise ValueError('Rechat window must be 1 to %d seconds: %s'
+                         % (RECHAT_WINDOW, window))
+    return window
+
+
+def replay_messages(windows, window=None):
+    """
+    Yield the messages of (offset, messages) rechat windows, skipping the
+    ones repeated from earlier windows. Rechat always returns
+    RECHAT_WINDOW seconds of chat, so with smaller windows a message
+    shows up in the next ceil(RECHAT_WINDOW / window) windows.
+    """
+    window = window or RECHAT_WINDOW
+    recent = deque(maxlen=int(math.ceil(float(RECHAT_WINDOW) / window)))
+    for offset, messages in windows:
+        cache = set()
+        for message in messages:
+            mid = message.get("id")
+            seen = any(mid in ids for ids in recent)
+            cache.add(mid)
+            if not seen:
                 yield message
+        recent.append(cache)
 
-            start += 30
+
+def _message_time(message):
+    return message.get("attributes", {}).get("timestamp")
 
 
 class ChatMessage(BaseModel):
@@ -278,6 +525,7 @@ class ChatMessage(BaseModel):
             'from': self.attributes['from'],
             'message': self.attributes.message,
             'subscriber': self.attributes.tags.subscriber,
+            'timestamp': getattr(self.attributes, 'timestamp', None),
         })
 
     @staticmethod
@@ -310,3 +558,43 @@ class Chatters(BaseModel):
 class LootsStream(BaseModel):
     # TODO
     pass
+
+
+class CompactChannel(CompactModel, Entity):
+    __slots__ = ()
+
+
+class CompactUser(CompactModel, Entity):
+    __slots__ = ()
+
+
+class CompactFollow(CompactModel):
+    __slots__ = ()
+    type_classes = {
+        'user': CompactUser,
+        'channel': CompactChannel,
+    }
+
+    def typeForKey(self, key, val):
+        type_class = self.type_classes.get(key, None)
+        if type_class:
+            return type_class(val)
+        return Model.typeForKey(self, key, val)
+
+
+class CompactChatMessage(CompactModel):
+    __slots__ = ()
+
+    def field(self, key):
+        if key in ('from', 'message'):
+            return self._raw['attributes'][key]
+        if key == 'subscriber':
+            return self._raw['attributes']['tags']['subscriber']
+        if key == 'timestamp':
+            return self._raw['attributes'].get('timestamp')
+        return CompactModel.field(self, key)
+
+    def typeForKey(self, key, val):
+        if key == 'attributes':
+            return ChatMessageAttributes(**val)
+        return Model.typeForKey(self, key, val)
@@ -1,38 +1,75 @@
 from itch import TwitchAPI, tab_print
-from itch.models import Channel, User, Video
+from itch.analytics import ChatStats
+from itch.archive import ChatArchive
+from itch.graph import FollowGraph
+from itch.models import Channel, Entity, User, Video
+from itch.sync import Checkpoints, FollowerSync
 from itch.times import subtime, to_timestamp
+from itch.warm import Warmer, coverage
+
+FOLLOWER_FIELDS = ('user.name', 'user.created_at', 'created_at')
+FOLLOWING_FIELDS = ('channel.name', 'channel.followers', 'created_at')
+GRAPH_FIELDS = ('user.name', 'created_at')
 
 
 def print_followers(channel, count_following=None,
                     limit=None, direction=None, return_lines=None,
-                    **kwargs):
+                    workers=None, unordered=None, parallel=None,
+                    sync=None, **kwargs):
     __set_caching(**kwargs)
     direction = direction or 'DESC'
+    synced = FollowerSync(channel) if sync else None
+
+    def follows():
+        if synced:
+            return synced.follows(fields=FOLLOWER_FIELDS)
+        c = Channel.get(channel)
+        return c.list_followers(direction=direction.upper(), limit=limit,
+                                fields=FOLLOWER_FIELDS, parallel=parallel)
+
+    def rows():
+        for f in follows():
+            yield f.user_name, [
+                f.user_name,
+                channel,
+                to_timestamp(f.user_created_at),
+                to_timestamp(f.created_at),
+                subtime(f.user_created_at, f.created_at),
+                0,
+            ]
 
-    c = Channel.get(channel)
-    for f in c.list_followers(direction=direction.upper(), limit=limit):
-        u = f.user
-        d = [
-            u.name,
-            channel,
-            to_timestamp(u.created_at),
-            to_timestamp(f.created_at),
-            subtime(u.created_at, f.created_at),
-            0,
-        ]
-
-        if count_following:
-            d.append(u.count_following())
-
-        if return_lines:
-            return d
-
-        tab_print(*d)
+    if count_following:
+        # checkpoints count written rows, so a sync keeps them in order
+        ordered = not unordered or bool(sync)
+        lines = __add_following(rows(), workers, ordered)
+    else:
+        lines = (d for u, d in rows())
+
+    store = Checkpoints().store(channel) if sync else None
+    written = 0
+    try:
+        for d in lines:
+            if return_lines:
+                return d
+
+            tab_print(*d)
+            if store:
+                line = u"\t".join(map(unicode, d)) + u"\n"
+                store.write(line.encode('utf8'))
+                written += 1
+                if synced.ready(written):
+                    store.flush()
+                    synced.commit(written)
+        if synced:
+            synced.commit(written)
+    finally:
+        if store:
+            store.close()
 
 
 def print_following(channel, count_following=None,
                     limit=None, direction=None, return_lines=None,
-                    **kwargs):
+                    parallel=None, **kwargs):
 
     __set_caching(**kwargs)
     direction = direction or 'DESC'
@@ -41,15 +78,15 @@ def print_following(channel, count_following=None,
     if count_following:
         following = u.count_following()
 
-    for f in u.list_following(direction=direction.upper(), limit=limit):
-        c = f.channel
+    for f in u.list_following(direction=direction.upper(), limit=limit,
+                              fields=FOLLOWING_FIELDS, parallel=parallel):
         d = [
             u.name,
-            c.name,
+            f.channel_name,
             to_timestamp(u.created_at),
             to_timestamp(f.created_at),
             subtime(u.created_at, f.created_at),
-            c.followers,
+            f.channel_followers,
         ]
 
         if count_following:
@@ -107,9 +144,8 @@ def followers(channel=None, **kwargs):
     tab_print(channel.name, channel.followers)
 
 
-def chatlog(channel, **kwargs):
-    video = Video.get(channel)
-    for m in video.chat_replay():
+def chatlog(channel, workers=None, archive=None, **kwargs):
+    for m in __chat_messages(channel, workers, archive):
         try:
             print u" : ".join([
                 m['from'].encode('utf8'),
@@ -119,11 +155,140 @@ def chatlog(channel, **kwargs):
             print "ERR <unprintable>"
 
 
+def chatstats(channel, workers=None, archive=None, interval=None, **kwargs):
+    video = Video.get(channel)
+    stats = ChatStats(interval or 60)
+    messages = __chat_messages(video, workers, archive)
+    for i in stats.feed(messages):
+        tab_print(
+            video.id,
+            video.channel.name,
+            i.start,
+            i.start,
+            i.messages,
+            len(i.chatters),
+            i.subscribers,
+        )
+
+
+def chattop(channel, workers=None, archive=None, limit=None, **kwargs):
+    stats = ChatStats()
+    for m in __chat_messages(channel, workers, archive):
+        stats.add(m['from'], m.message, m.subscriber)
+
+    tab_print('messages', stats.messages)
+    tab_print('chatters', stats.chatters.count())
+    tab_print('subscriber_share', '%.4f' % stats.subscriber_share())
+    for name, count, error in stats.emitters.top(limit or 10):
+        tab_print('emitter', name, count)
+    for word, count, error in stats.keywords.top(limit or 10):
+        tab_print('keyword', word, count)
+
+
+def graph_add(channel=None, limit=None, parallel=None, **kwargs):
+    __assert_args(channel)
+    __set_caching(**kwargs)
+
+    graph = FollowGraph.load()
+    for name in __channels(channel):
+        c = Channel.get(name)
+        graph.add_followers(name, c.list_followers(
+            limit=limit, fields=GRAPH_FIELDS, parallel=parallel),
+            replace=not limit)
+        tab_print(name, len(graph.followers(name)))
+    graph.save()
+
+
+def graph_overlap(channel=None, **kwargs):
+    __assert_args(channel)
+    channels = __channels(channel)
+
+    graph = FollowGraph.load()
+    for a, b, shared, jaccard in graph.pairs(channels):
+        tab_print(a, b, shared, '%.4f' % jaccard)
+    if len(channels) > 2:
+        tab_print(','.join(channels), len(graph.overlap(channels)))
+
+
+def graph_union(channel=None, **kwargs):
+    __assert_args(channel)
+    channels = __channels(channel)
+    tab_print(','.join(channels), len(FollowGraph.load().union(channels)))
+
+
+def graph_followed_before(channel=None, **kwargs):
+    __assert_args(channel)
+    channels = __channels(channel)
+    if len(channels) < 2:
+        raise Exception('Two channels not given')
+    first, then = channels[:2]
+    for name, first_ts, then_ts in FollowGraph.load().followed_before(
+            first, then):
+        tab_print(name, first, then, first_ts, then_ts)
+
+
+def warm(channel=None, endpoints=None, limit=None, workers=None,
+         parallel=None, **kwargs):
+    __assert_args(channel)
+    __set_caching(**kwargs)
+    if not TwitchAPI.caching:
+        raise Exception('Cache not given')
+
+    if endpoints:
+        endpoints = [e.strip() for e in endpoints.split(',')]
+    warmer = Warmer(endpoints, limit, workers, parallel)
+    was_cached, was_fetched = coverage(TwitchAPI.caching)
+    for name, endpoint, items, seconds, error in warmer.run(
+            __channels(channel)):
+        tab_print(endpoint, name, items, '%.2f' % seconds,
+                  'error: %s' % error if error else 'ok')
+
+    cached, fetched = coverage(TwitchAPI.caching)
+    cached, fetched = cached - was_cached, fetched - was_fetched
+    total = cached + fetched
+    tab_print('cached', cached)
+    tab_print('fetched', fetched)
+    tab_print('coverage', '%.4f' % (float(cached) / total if total else 1))
+
+
+def __add_following(rows, workers=None, ordered=True):
+    # one pool over the whole stream; rows wait here until counted
+    waiting = {}
+
+    def users():
+        for i, (name, d) in enumerate(rows):
+            waiting[i] = d
+            yield User(name=name)
+
+    for i, count in Entity.count_following_many(users(), workers, ordered):
+        yield waiting.pop(i) + [count]
+
+
+def __chat_messages(video, workers=None, archive=None):
+    if archive:
+        vid_id = video.id if isinstance(video, Video) else video
+        archive = ChatArchive(vid_id)
+        # a finished archive needs neither the video nor any request
+        if not archive.complete():
+            if not isinstance(video, Video):
+                video = Video.get(video)
+            archive.download(video, workers=workers)
+        return archive.messages(compact=True)
+
+    if not isinstance(video, Video):
+        video = Video.get(video)
+    return video.chat_replay(workers=workers, compact=True)
+
+
 def __assert_args(channel=None, **kwargs):
     if not channel:
         raise Exception('Channel not given')
 
 
+def __channels(channel):
+    return [c.strip().lower() for c in channel.split(',') if c.strip()]
+
+
 def __get_cache(cache):
     if cache == 'file':
         from cache.filetree import FileTreeCache
@@ -134,10 +299,16 @@ def __get_cache(cache):
     if cache == 'memcache':
         from cache.mcache import MemcacheCache
         return MemcacheCache()
+    if cache == 'sqlite':
+        from cache.sqlcache import SQLiteCache
+        return SQLiteCache()
 
 
 def __set_caching(**kwargs):
     caching = __get_cache(kwargs.get('caching'))
+    if caching and kwargs.get('memory_cache'):
+        from cache.lru import LRUCache
+        caching = LRUCache(caching, kwargs['memory_cache'] * 1024 * 1024)
     if caching:
         TwitchAPI.set_caching(caching)
 
@@ -147,7 +318,14 @@ reports = dict(
     loots_streams=loots_streams,
     chatters=chatters,
     chatlog=chatlog,
+    chatstats=chatstats,
+    chattop=chattop,
     created=created,
     num_following=following,
     num_followers=followers,
+    graph_add=graph_add,
+    overlap=graph_overlap,
+    union=graph_union,
+    followed_before=graph_followed_before,
+    warm=warm,
 )
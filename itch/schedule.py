@@ -0,0 +1,107 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+from urlparse import urlsplit
+from log import logger
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` requests per second on average, in bursts of up to
+    `burst`; a rate of 0 is unlimited. Shared by every thread that takes
+    from it.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = float(burst or max(1, self.rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    elapsed = now - self.updated
+                    self.tokens = min(self.burst,
+                                      self.tokens + elapsed * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+class Scheduler(object):
+    """
+    Paces requests with a token bucket per host, and decides how long to
+    back off before retrying throttled or failed requests: the server's
+    Retry-After when given, else exponential backoff with full jitter.
+    A throttled response (a 429, or any with Retry-After) pauses the
+    whole host, not just one caller.
+    """
+
+    def __init__(self, rate=None, burst=None, retries=3,
+                 backoff=0.3, max_backoff=60):
+        if rate is None:
+            rate = float(os.environ.get('TWITCH_RATE_LIMIT', 0))
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).take()
+
+    def retryable(self, status_code):
+        return status_code == 429 or status_code >= 500
+
+    def delay(self, url, attempt, retry_after=None, status_code=None):
+        hint = parse_retry_after(retry_after)
+        if hint is not None:
+            delay = min(hint, self.max_backoff)
+        else:
+            cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay = random.uniform(0, cap)
+
+        if hint is not None or status_code == 429:
+            self.bucket(url).pause(delay)
+        logger.warning('Backing off %.2fs: %s', delay, url)
+        return delay
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed:
+            return max(0.0, mktime_tz(parsed) - time.time())
@@ -0,0 +1,132 @@
+import json
+import os
+from collections import deque
+from cache.filetree import write_atomic
+from itch import KRAKEN, MAX_GET
+from models import Entity, Follow, CompactFollow, model_for, follow_id
+from workers import read_ahead
+from times import to_timestamp
+
+
+class Checkpoints(object):
+    """
+    Per-channel sync state, kept as small json files: the newest follow
+    seen by the last complete run, and the cursor of an unfinished one.
+    """
+    path = os.environ.get('TWITCH_SYNC_DIR', '/tmp/itch-sync')
+
+    def __init__(self, path=None):
+        self.path = path or Checkpoints.path
+
+    def filename(self, channel, ext='json'):
+        return os.path.join(self.path, '%s.%s' % (channel.lower(), ext))
+
+    def load(self, channel):
+        try:
+            with open(self.filename(channel), 'r') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+
+    def save(self, channel, state):
+        write_atomic(self.filename(channel), json.dumps(state))
+
+    def store(self, channel):
+        """
+        Append-only file for the rows synced for a channel.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        return open(self.filename(channel, 'tsv'), 'a')
+
+
+class FollowerSync(object):
+    """
+    Yields only the follows made since the previous run, newest first,
+    stopping as soon as the checkpoint is reached. Progress is marked
+    after every page, and saved by commit() once the consumer has written
+    the rows before it, so an interrupted run resumes where it stopped
+    without losing rows.
+    """
+
+    def __init__(self, channel, checkpoints=None):
+        self.channel = channel.lower().strip()
+        self.checkpoints = checkpoints or Checkpoints()
+        self.sent = 0
+        self.marks = deque()
+
+    def url(self):
+        url = '{}/channels/{}/follows?direction=DESC&limit={}'
+        return url.format(KRAKEN, self.channel, MAX_GET)
+
+    def follows(self, compact=False, fields=None):
+        model = model_for(Follow, CompactFollow, compact, fields)
+        state = self.checkpoints.load(self.channel)
+        checkpoint = state.get('newest')
+        pending = state.get('pending') or {}
+        newest = pending.get('newest')
+
+        pages = Entity.follow_pages(self.url(), pending.get('cursor'))
+        for res in read_ahead(pages):
+            for follow in res.get('follows', []):
+                if reached(follow, checkpoint):
+                    self.finish(newest or checkpoint)
+                    return
+
+                if not newest:
+                    newest = marker(follow)
+                self.sent += 1
+                yield model(dict(follow, total=res.get('_total')))
+
+            cursor = res.get('_cursor')
+            if not cursor:
+                break
+            self.mark(dict(state, pending={'cursor': cursor,
+                                           'newest': newest}))
+
+        self.finish(newest or checkpoint)
+
+    def finish(self, newest):
+        self.mark({'newest': newest})
+
+    def mark(self, state):
+        self.marks.append((self.sent, state))
+
+    def ready(self, written=None):
+        """
+        Whether commit(written) would save a checkpoint.
+        """
+        if written is None:
+            written = self.sent
+        return bool(self.marks) and self.marks[0][0] <= written
+
+    def commit(self, written=None):
+        """
+        Save the latest checkpoint covered once the first `written` rows
+        (default: all yielded so far) have been printed or stored.
+        """
+        if written is None:
+            written = self.sent
+        state = None
+        while self.marks and self.marks[0][0] <= written:
+            state = self.marks.popleft()[1]
+        if state is not None:
+            self.checkpoints.save(self.channel, state)
+
+
+def marker(follow):
+    return {
+        'created_at': follow.get('created_at'),
+        'user_id': follow_id(follow),
+    }
+
+
+def reached(follow, checkpoint):
+    if not checkpoint:
+        return False
+
+    followed = to_timestamp(follow.get('created_at'))
+    seen = to_timestamp(checkpoint['created_at'])
+    if followed != seen:
+        return followed < seen
+    return follow_id(follow) == checkpoint['user_id']
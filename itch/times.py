@@ -1,22 +1,63 @@
+import re
 from datetime import datetime
 from dateutil.parser import parse as dateparse
+from trace import span
+
+EPOCH = datetime(1970, 1, 1)
+MEMO_SIZE = 65536
+
+ISO_8601 = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)'
+    r'(?:\.(\d{1,6})\d*)?(?:Z|[+-]00:?00)?$'
+)
+
+memo = {}
 
 
 def to_datetime(date_string):
     if isinstance(date_string, (datetime,)):
         return date_string
 
-    if isinstance(date_string, (int,)):
+    if isinstance(date_string, (int, long)):
         return datetime.utcfromtimestamp(date_string)
 
-    return dateparse(date_string).replace(tzinfo=None)
+    dt = memo.get(date_string)
+    if dt is None:
+        with span('dates'):
+            dt = parse(date_string)
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        memo[date_string] = dt
+    return dt
+
+
+def parse(date_string):
+    """
+    Parse the fixed ISO-8601 shapes Twitch uses, in UTC, without dateutil;
+    anything else goes through dateutil.
+    """
+    mat = ISO_8601.match(date_string)
+    if not mat:
+        return dateparse(date_string).replace(tzinfo=None)
+
+    year, month, day, hour, minute, second, fraction = mat.groups()
+    micro = int(fraction.ljust(6, '0')) if fraction else 0
+    return datetime(int(year), int(month), int(day),
+                    int(hour), int(minute), int(second), micro)
 
 
 def to_timestamp(dt):
-    epoch = datetime(1970, 1, 1).replace(tzinfo=None)
     if not isinstance(dt, (datetime, )):
         dt = to_datetime(dt)
-    return int((dt - epoch).total_seconds())
+    return int((dt - EPOCH).total_seconds())
+
+
+def to_datetimes(values):
+    return [to_datetime(v) for v in values]
+
+
+def to_timestamps(values):
+    return [to_timestamp(v) for v in values]
 
 
 def subtime(a, b):
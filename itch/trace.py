@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# callables taking (phase, label, seconds), run as each span ends
+hooks = []
+
+
+def add_hook(hook):
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+@contextmanager
+def span(phase, label=None):
+    """
+    Time the enclosed block and pass it to every hook. Phases are
+    'network', 'decode', 'cache.get', 'cache.set', 'codec', 'model',
+    'dates' and 'output'; spans nest, so times are inclusive.
+    """
+    if not hooks:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        for hook in list(hooks):
+            hook(phase, label, elapsed)
+
+
+class Profiler(object):
+    """
+    Samples the stacks of every thread from a background thread and
+    writes them in the collapsed format read by flamegraph.pl and
+    speedscope: `thread;frame;frame count` per line. Sampling the wall
+    clock shows time spent waiting on the network as well as on CPU.
+    """
+
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.interval = interval or float(
+            os.environ.get('TWITCH_PROFILE_INTERVAL', 0.005))
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.write()
+
+    def run(self):
+        me = threading.current_thread().ident
+        while not self.stopped.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.sample(names.get(ident, str(ident)), frame)
+
+    def sample(self, thread, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (
+                code.co_name,
+                os.path.basename(code.co_filename),
+                code.co_firstlineno,
+            ))
+            frame = frame.f_back
+        stack.append(thread)
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+
+@contextmanager
+def profile(path):
+    profiler = Profiler(path).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
@@ -0,0 +1,95 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import (ProtocolError,
+                                                  ReadTimeoutError)
+from urlparse import urlsplit
+from log import logger
+
+
+class Transport(object):
+    """Connection-pooled sessions, one per host, shared by all threads."""
+
+    def __init__(self, pool_size=None, timeout=None, keep_alive=True,
+                 verify=False, headers=None):
+        self.pool_size = int(pool_size or
+                             os.environ.get('TWITCH_POOL_SIZE', 10))
+        self.timeout = float(timeout or
+                             os.environ.get('TWITCH_TIMEOUT', 30))
+        self.keep_alive = keep_alive
+        self.verify = verify
+        self.headers = headers or {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        host = urlsplit(url).netloc
+        session = self.sessions.get(host)
+        if session:
+            return session
+
+        with self.lock:
+            session = self.sessions.get(host)
+            if not session:
+                session = self.make_session()
+                self.sessions[host] = session
+                logger.debug('Session: %s (pool %d)', host, self.pool_size)
+        return session
+
+    def make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # only the encodings cache.codec can decode, whatever else
+        # urllib3 happens to support
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.headers.update(self.headers)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def get(self, url, params=None, headers=None):
+        return self.session(url).get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=self.timeout,
+            verify=self.verify,
+        )
+
+    def fetch(self, url, params=None, headers=None):
+        """
+        Like get, but also returns the body as received on the wire (still
+        content-encoded) along with its Content-Encoding.
+        """
+        res = self.session(url).get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=self.timeout,
+            verify=self.verify,
+            stream=True,
+        )
+        # reading raw skips requests' wrapping of urllib3's errors
+        try:
+            wire = res.raw.read(decode_content=False)
+        except ReadTimeoutError as e:
+            raise requests.Timeout(e, request=res.request, response=res)
+        except ProtocolError as e:
+            raise requests.ConnectionError(e, request=res.request,
+                                           response=res)
+        finally:
+            res.close()
+        return res, wire, res.headers.get('content-encoding')
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
@@ -0,0 +1,110 @@
+import time
+from itch import TwitchAPI as API
+from itch import KRAKEN
+from log import logger
+from metrics import metrics
+from models import Channel, User, Video
+from workers import Workers
+
+ENDPOINTS = ('profile', 'followers', 'following', 'videos', 'chat')
+
+
+class Warmer(object):
+    """
+    Fills the configured cache with the requests the reports make for a
+    set of channels, so later runs read them from the cache. Channels are
+    warmed concurrently, under the scheduler's rate limit; responses
+    already cached are not fetched again. Lists are walked with the same
+    urls as the reports (newest first), so `limit` and `parallel` should
+    match the report's.
+    """
+
+    def __init__(self, endpoints=None, limit=None, workers=None,
+                 parallel=None):
+        self.endpoints = endpoints or ENDPOINTS
+        self.limit = limit
+        self.workers = workers
+        self.parallel = parallel
+        for endpoint in self.endpoints:
+            if endpoint not in ENDPOINTS:
+                raise ValueError('Unknown endpoint: %s' % endpoint)
+
+    def run(self, channels):
+        """
+        Yields (channel, endpoint, items, seconds, error) per channel
+        and endpoint, as each finishes.
+        """
+        tasks = [(c, e) for c in channels for e in self.endpoints]
+        return Workers(self.workers).map(self.warm, tasks, ordered=False)
+
+    def warm(self, task):
+        channel, endpoint = task
+        start = time.time()
+        try:
+            items = getattr(self, 'warm_' + endpoint)(channel)
+            return channel, endpoint, items, time.time() - start, None
+        except Exception as e:
+            logger.warning('Warming %s %s failed: %s', endpoint, channel, e)
+            return channel, endpoint, 0, time.time() - start, e
+
+    def warm_profile(self, channel):
+        requests = [
+            ('{}/channels/{}'.format(KRAKEN, channel), None),
+            ('{}/users/{}'.format(KRAKEN, channel), None),
+        ]
+        return sum(1 for i, res in API.get_many(requests))
+
+    def warm_followers(self, channel):
+        follows = Channel(name=channel).list_followers(
+            direction='DESC', limit=self.limit, fields=('created_at',),
+            parallel=self.parallel)
+        return sum(1 for f in follows)
+
+    def warm_following(self, channel):
+        user = User(name=channel)
+        user.count_following()
+        follows = user.list_following(
+            direction='DESC', limit=self.limit, fields=('created_at',),
+            parallel=self.parallel)
+        return sum(1 for f in follows)
+
+    def warm_videos(self, channel):
+        videos = Channel(name=channel).past_streams(
+            cap=self.limit, fields=('id',), parallel=self.parallel)
+        return sum(1 for v in videos)
+
+    def warm_chat(self, channel):
+        """
+        Chat of the channel's latest `limit` videos (default 1), or of
+        the video itself when given a video id.
+        """
+        if _video_id(channel):
+            ids = [channel]
+        else:
+            videos = Channel(name=channel).past_streams(
+                cap=self.limit or 1, fields=('id',))
+            ids = [v.id for v in videos]
+
+        count = 0
+        for vid_id in ids:
+            video = Video.get(vid_id)
+            for m in video.chat_replay(workers=self.workers, compact=True):
+                count += 1
+        return count
+
+
+def coverage(cache):
+    """
+    (cached, fetched) response counts of the cache adapter so far:
+    responses found in the cache, and responses fetched and written to it.
+    """
+    backend = getattr(cache, 'backend', cache)
+    name = backend.name()
+    counters = metrics.snapshot()['counters']
+    cached = counters.get('cache.hit', {}).get(name, 0)
+    fetched = counters.get('cache.write', {}).get(name, 0)
+    return cached, fetched
+
+
+def _video_id(name):
+    return name[:1] == 'v' and name[1:].isdigit()
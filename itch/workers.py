@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+from Queue import Queue, Empty, Full
+
+DONE = object()
+ERROR = object()
+FEED_DONE = object()
+
+
+class Workers(object):
+    """
+    Bounded thread pool for driving many API calls at once.
+    At most `size` calls are in flight; items are consumed lazily.
+    """
+
+    def __init__(self, size=None):
+        self.size = max(1, int(size or os.environ.get('TWITCH_WORKERS', 8)))
+
+    def map(self, func, items, ordered=True):
+        for item, val in self.stream(lambda i: [func(i)], items, ordered):
+            yield val
+
+    def each(self, entities, method, *args, **kwargs):
+        def call(entity):
+            return getattr(entity, method)(*args, **kwargs)
+        return self.stream(call, entities, ordered=False)
+
+    def stream(self, func, items, ordered=True):
+        """
+        Run the generator `func(item)` for every item concurrently,
+        yielding (item, value) pairs as they are produced.
+        """
+        stop = threading.Event()
+        tasks = Queue(self.size)
+        out = Queue(self.size * 4)
+
+        def feed():
+            count = 0
+            try:
+                for count, item in enumerate(items, 1):
+                    if not _put(tasks, (count - 1, item), stop):
+                        return
+            except Exception:
+                _put(out, (count, None, ERROR, sys.exc_info()), stop)
+            finally:
+                if hasattr(items, 'close'):
+                    items.close()
+                for _ in range(self.size):
+                    _put(tasks, None, stop)
+            _put(out, (count, None, FEED_DONE, None), stop)
+
+        def work():
+            while not stop.is_set():
+                task = _get(tasks, stop)
+                if task is None:
+                    return
+                index, item = task
+                try:
+                    for val in func(item):
+                        if not _put(out, (index, item, val, None), stop):
+                            return
+                    _put(out, (index, item, DONE, None), stop)
+                except Exception:
+                    _put(out, (index, item, ERROR, sys.exc_info()), stop)
+
+        threads = [threading.Thread(target=feed)]
+        threads += [threading.Thread(target=work) for _ in range(self.size)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        total = None
+        finished = set()
+        pending = {}
+        current = 0
+        try:
+            while total is None or len(finished) < total:
+                index, item, val, exc_info = out.get()
+                if val is ERROR:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+                if val is FEED_DONE:
+                    total = index
+                    continue
+
+                if not ordered:
+                    if val is DONE:
+                        finished.add(index)
+                    else:
+                        yield item, val
+                    continue
+
+                if val is DONE:
+                    finished.add(index)
+                elif index == current:
+                    yield item, val
+                    continue
+                else:
+                    pending.setdefault(index, []).append((item, val))
+
+                while current in finished:
+                    for pair in pending.pop(current, []):
+                        yield pair
+                    current += 1
+                    for pair in pending.pop(current, []):
+                        yield pair
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+
+def read_ahead(pages, depth=None):
+    """
+    Drive the `pages` generator from a background thread, fetching up to
+    `depth` pages ahead of the consumer. Closing the returned generator
+    stops the producer.
+    """
+    if depth is None:
+        depth = int(os.environ.get('TWITCH_READ_AHEAD', 2))
+    if depth <= 0:
+        for page in pages:
+            yield page
+        return
+
+    stop = threading.Event()
+    out = Queue(depth)
+
+    def produce():
+        try:
+            for page in pages:
+                if not _put(out, (page, None), stop):
+                    return
+            _put(out, (DONE, None), stop)
+        except Exception:
+            _put(out, (ERROR, sys.exc_info()), stop)
+        finally:
+            pages.close()
+
+    t = threading.Thread(target=produce)
+    t.daemon = True
+    t.start()
+    try:
+        while True:
+            page, exc_info = out.get()
+            if page is DONE:
+                break
+            if page is ERROR:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            yield page
+    finally:
+        stop.set()
+        t.join()
+
+
+def chunks(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _put(queue, val, stop):
+    while not stop.is_set():
+        try:
+            queue.put(val, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _get(queue, stop):
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            pass
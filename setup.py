@@ -10,7 +10,7 @@ cache_requires = ['redis', 'python-memcached']
 setup(
     name='itch',
     version='0.3.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['bench']),
     description='Twitch APIs client',
     long_description=long_description,
     author='bibby',
@@ -20,7 +20,8 @@ setup(
     install_requires=['requests', 'dateutils', 'argparse'],
     entry_points={'console_scripts': [
         'itch = cli:main',
-        'itch-plot = plot:main'
+        'itch-plot = plot:main',
+        'itch-cache-migrate = cache.filetree:main',
     ]},
     extras_require={
         'plot':  plot_requires,
@@ -0,0 +1,22 @@
+import unittest
+from itch.models import replay_messages
+
+
+def windows(window, length=30):
+    # every window returns the 30 seconds of chat after its offset
+    for offset in range(0, length, window):
+        yield offset, [{'id': t} for t in range(offset, offset + 30)]
+
+
+class ReplayMessagesTest(unittest.TestCase):
+    def test_default_window(self):
+        ids = [m['id'] for m in replay_messages(windows(30, 90), 30)]
+        self.assertEqual(ids, range(90))
+
+    def test_small_window(self):
+        ids = [m['id'] for m in replay_messages(windows(10), 10)]
+        self.assertEqual(ids, range(50))
+
+
+if __name__ == '__main__':
+    unittest.main()
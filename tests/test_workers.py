@@ -0,0 +1,21 @@
+import unittest
+from itch.workers import Workers
+
+
+class WorkersTest(unittest.TestCase):
+    def test_map_keeps_none_items(self):
+        items = [1, None, 3, None, 5]
+        self.assertEqual(list(Workers(2).map(lambda x: x, items)), items)
+
+    def test_map_unordered_keeps_none_items(self):
+        items = [None, 2, None, 4]
+        found = list(Workers(3).map(lambda x: x, items, ordered=False))
+        self.assertEqual(sorted(found), sorted(items))
+
+    def test_stream_none_item(self):
+        pairs = list(Workers(2).stream(lambda x: [x, x], [None, 1]))
+        self.assertEqual(pairs, [(None, None), (None, None), (1, 1), (1, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()